@@ -1,32 +1,467 @@
-import pyaudio
+from __future__ import print_function
 import numpy as np
 import wave
 import sys
 import math
-import random
-import pylab as pl
+import struct
+import time
+import atexit
+import threading
+try:
+    from math import gcd
+except ImportError:  # python 2
+    from fractions import gcd
 
-# seed the random number generator
-random.seed()
+# PortAudio sample formats and stream callback results, the values of the pyaudio constants
+# of the same names. pyaudio (and pylab) are only imported when a stream is opened (or a
+# plot is drawn), so making, converting and saving buffers doesn't load either of them.
+paFloat32 = 1
+paInt32 = 2
+paInt24 = 4
+paInt16 = 8
+paInt8 = 16
+paContinue = 0
+paComplete = 1
 
 # Some default values for the audio format
 CHUNK = 256
-FORMAT = pyaudio.paInt16
+FORMAT = paInt16
 CHANNELS = 1
 RATE = 48000
 # This is needed for rescaling
 MAX_AMP = 2**15
+# WAV payloads at least this big are memory-mapped by Audio.load rather than read
+MMAP_THRESHOLD = 2**20
+# Status flag PortAudio passes to an input callback when samples were lost before it was called
+INPUT_OVERFLOW = 0x2
+# Format tags of the WAV fmt chunk
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+# The sample formats an Audio object can hold: the numpy type of the samples in memory and
+# their width in a WAV file. 8 bit WAV samples are unsigned, they are held signed. 24 bit
+# samples have no numpy type, they are held as int32 scaled to its full range (the low byte is 0).
+SAMPLE_FORMATS = {
+    paInt8: (np.int8, 1),
+    paInt16: (np.int16, 2),
+    paInt24: (np.int32, 3),
+    paInt32: (np.int32, 4),
+    paFloat32: (np.float32, 4),
+}
 
+# The PortAudio connection is shared by every Audio object in the process.
+# It is only started the first time a stream is opened (i.e. by play() or
+# record()), so creating and processing buffers never touches the audio device.
+_pyaudio = None
+_pyaudio_lock = threading.Lock()
 
-class Audio(pyaudio.PyAudio):
+
+# Get the process wide PortAudio connection, starting it on first use
+def get_pyaudio():
+    global _pyaudio
+    with _pyaudio_lock:
+        if _pyaudio is None:
+            import pyaudio
+            _pyaudio = pyaudio.PyAudio()
+            # Shut PortAudio down once, when the interpreter exits
+            atexit.register(_pyaudio.terminate)
+    return _pyaudio
+
+
+# Read the header of a RIFF/WAVE file in one pass, see read_wav_format
+# input: file object positioned at the start of the file
+# output: (channels, rate, sample width in bytes, byte offset of the PCM data, number of frames)
+def read_wav_header(f):
+    return read_wav_format(f)[:5]
+
+
+# As read_wav_header, plus the format tag (WAVE_FORMAT_PCM or WAVE_FORMAT_IEEE_FLOAT, the sub format
+# of WAVE_FORMAT_EXTENSIBLE files) as a sixth item
+def read_wav_format(f):
+    riff, size, wave_id = struct.unpack('<4sI4s', f.read(12))
+    if riff != b'RIFF' or wave_id != b'WAVE':
+        raise wave.Error("file does not start with a RIFF/WAVE header")
+    fmt = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            raise wave.Error("no data chunk found")
+        chunk_id, chunk_size = struct.unpack('<4sI', header)
+        if chunk_id == b'fmt ':
+            fmt = struct.unpack('<HHIIHH', f.read(16))
+            extension = f.read(chunk_size - 16)
+            # the real format of WAVE_FORMAT_EXTENSIBLE files is the first two bytes of the sub format GUID
+            if fmt[0] == WAVE_FORMAT_EXTENSIBLE and len(extension) >= 10:
+                fmt = struct.unpack('<H', extension[8:10]) + fmt[1:]
+            f.seek(chunk_size & 1, 1)
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise wave.Error("data chunk found before fmt chunk")
+            break
+        else:
+            # chunks are word aligned, so odd sized chunks carry a pad byte
+            f.seek(chunk_size + (chunk_size & 1), 1)
+    tag, channels, rate, byte_rate, block_align, bits = fmt
+    width = (bits + 7) // 8
+    offset = f.tell()
+    # Streamed files may not have had their sizes filled in, so never
+    # trust the header to be smaller than what is actually on disk
+    f.seek(0, 2)
+    data_size = min(chunk_size, f.tell() - offset)
+    return channels, rate, width, offset, data_size // (width * channels), tag
+
+
+# The value of a full scale sample of a format, in the units the samples are held in
+# (1.0 for float samples, 2**15 for int16, 2**31 for 24 bit samples held as int32)
+def format_scale(format):
+    nptype, width = SAMPLE_FORMATS[format]
+    if np.issubdtype(nptype, np.floating):
+        return 1.0
+    return float(np.iinfo(nptype).max) + 1
+
+
+# The number of bits of a format (None for float samples)
+def format_bits(format):
+    nptype, width = SAMPLE_FORMATS[format]
+    return None if np.issubdtype(nptype, np.floating) else width * 8
+
+
+# Convert samples from one format of SAMPLE_FORMATS to another, e.g. int16 samples to float32 for
+# processing and back to int16 (or to 24 bit) for saving, in a few whole array operations.
+# Float samples are between -1.0 and 1.0 and are not clipped; conversions to an integer format
+# with fewer bits round to the nearest value (after adding triangular dither of one least significant
+# bit with dither=True) and clip anything out of its range, conversions to one with more bits are exact.
+# input: numpy array, formats to convert from and to (pyaudio formats), dither (bool)
+# output: numpy array (the input itself if the formats are the same)
+def convert_samples(data, from_format, to_format, dither=False):
+    if from_format == to_format:
+        return data
+    nptype = SAMPLE_FORMATS[to_format][0]
+    bits = format_bits(to_format)
+    from_bits = format_bits(from_format)
+    if bits is None:
+        return np.multiply(data, 1.0 / format_scale(from_format), dtype=nptype)
+    if from_bits is not None and from_bits <= bits:
+        return data.astype(nptype) * nptype(format_scale(to_format) // format_scale(from_format))
+    levels = 2.0 ** (bits - 1)
+    # float32 holds every 16 bit value (and 24 bits of precision), wider formats need float64
+    array = np.multiply(data, levels / format_scale(from_format), dtype=np.float32 if bits <= 16 else np.float64)
+    if dither:
+        array += np.random.random_sample(len(array))
+        array -= np.random.random_sample(len(array))
+    np.rint(array, out=array)
+    np.clip(array, -levels, levels - 1, out=array)
+    out = array.astype(nptype)
+    # 24 bit samples are held in the top three bytes of an int32
+    step = int(format_scale(to_format) / levels)
+    if step != 1:
+        out *= step
+    return out
+
+
+# The bytes of samples as they are stored in a WAV file of the given sample width:
+# 8 bit samples are unsigned and 24 bit samples (held as int32) are packed into three bytes
+# input: numpy array, sample width in bytes, output: numpy array (the input itself for other widths)
+def wav_samples(data, width):
+    if width == 1 and data.dtype == np.int8:
+        return data.view(np.uint8) ^ np.uint8(0x80)
+    if width == 3:
+        return data.astype('<i4').view(np.uint8).reshape(-1, 4)[:, 1:]
+    return data
+
+
+# The inverse of wav_samples: samples read from a WAV file as held in memory
+# input: raw samples (numpy uint8 array for 8 and 24 bit samples), sample width in bytes
+def from_wav_samples(raw, width):
+    if width == 1:
+        return raw.view(np.int8) ^ np.int8(-128)
+    if width == 3:
+        unpacked = np.zeros((len(raw) // 3, 4), dtype=np.uint8)
+        unpacked[:, 1:] = raw.reshape(-1, 3)
+        return unpacked.view('<i4').ravel().astype(np.int32)
+    return raw
+
+
+# Convert floating point samples to an integer type, clipping anything out of its range
+# (values are truncated towards zero, as assigning a float to an integer array does)
+# input: numpy float array (modified in place), numpy integer type, output: numpy array of that type
+def to_int(array, nptype):
+    info = np.iinfo(nptype)
+    np.clip(array, info.min, info.max, out=array)
+    return array.astype(nptype)
+
+
+# Store samples computed in floating point, in the units of a sample type, as that type:
+# integer types are clipped (and rounded to the nearest value with rounding=True, truncated otherwise, see to_int),
+# float samples stay unclipped until they are converted to an integer format (see convert_samples)
+# input: numpy float array (modified in place), numpy type, output: numpy array of that type
+def to_type(array, nptype, rounding=False):
+    if np.issubdtype(nptype, np.floating):
+        return array.astype(nptype, copy=False)
+    if rounding:
+        np.rint(array, out=array)
+    return to_int(array, nptype)
+
+
+# The floating point type processing of samples of a type is done in: float32 keeps float32 buffers
+# at half the memory traffic of float64, integer samples keep float64 so results don't change
+def work_type(nptype):
+    return np.float32 if np.issubdtype(nptype, np.floating) else np.float64
+
+
+# Design the low pass filter of a polyphase resampler: a Kaiser windowed sinc with its cutoff at
+# the lower of the two Nyquist frequencies, scaled by up to make up for the inserted zeros
+# input: up and down factors (int), zero crossings on each side (int), Kaiser beta, output: taps (numpy float array)
+def resample_filter(up, down, zero_crossings=16, beta=8.0):
+    factor = max(up, down)
+    half = zero_crossings * factor
+    n = np.arange(-half, half + 1)
+    return up * np.sinc(n / float(factor)) / factor * np.kaiser(2 * half + 1, beta)
+
+
+# Resample by the rational factor up/down with a polyphase filter: only the taps that meet
+# non-zero samples of the upsampled signal are applied, one output block at a time
+# (every output sample of a block gathers its input window with a single fancy index)
+# input: samples (numpy array), up and down factors (int), output: resampled samples (numpy float array)
+def resample_poly(data, up, down, block=2**16):
+    g = gcd(up, down)
+    up, down = up // g, down // g
+    data = np.asarray(data, dtype=np.float64)
+    if up == down:
+        return data.copy()
+    taps = resample_filter(up, down)
+    half = len(taps) // 2
+    # arrange the taps by phase: phases[p, t] is taps[p + t * up]
+    n_taps = -(-len(taps) // up)
+    phases = np.zeros(n_taps * up)
+    phases[:len(taps)] = taps
+    phases = phases.reshape(n_taps, up).T.copy()
+    # output sample m sits at m * down in the upsampled signal, so it uses the
+    # phase (m * down + half) % up and the inputs that end at (m * down + half) // up
+    n_out = -(-len(data) * up // down)
+    padded = np.concatenate([np.zeros(n_taps), data, np.zeros(n_taps)])
+    out = np.empty(n_out)
+    offsets = np.arange(n_taps)
+    for start in range(0, n_out, block):
+        position = np.arange(start, min(start + block, n_out)) * down + half
+        phase, last = position % up, position // up
+        window = padded[(last + n_taps)[:, None] - offsets]
+        out[start:start + len(position)] = np.einsum('ij,ij->i', window, phases[phase])
+    return out
+
+
+# Split a signal into overlapping frames without copying: the frames are a read-only strided
+# view of the signal (zero padded at the end so the last frame is complete)
+# input: samples (numpy array), frame length and hop in samples (int), output: numpy array (frames x frame_length)
+def frame_signal(data, frame_length, hop):
+    n_frames = 1 + max(0, -(-(len(data) - frame_length) // hop))
+    padded = np.zeros((n_frames - 1) * hop + frame_length, dtype=np.float64)
+    padded[:len(data)] = data
+    stride = padded.strides[0]
+    return np.lib.stride_tricks.as_strided(padded, shape=(n_frames, frame_length),
+                                           strides=(hop * stride, stride), writeable=False)
+
+
+# Short time Fourier transform: every frame is windowed and transformed in one batched rfft
+# the signal is padded by half a frame at each end, so every sample is covered by full overlap
+# input: samples (numpy array), frame length and hop in samples (int), window (numpy array, default hanning)
+# output: spectrum (complex numpy array, frames x (frame_length // 2 + 1))
+def stft(data, frame_length=1024, hop=256, window=None):
+    if window is None:
+        window = np.hanning(frame_length)
+    pad = np.zeros(frame_length // 2)
+    frames = frame_signal(np.concatenate([pad, data, pad]), frame_length, hop)
+    return np.fft.rfft(frames * window, axis=1)
+
+
+# Add frames into a signal at every hop, starting at frame number first: one shifted add of a
+# hop sized column of all the frames at once for each hop that fits in a frame
+# input: signal (numpy float array, modified in place), frames (numpy array, frames x frame_length),
+#        hop in samples (int), index of the first frame (int)
+def overlap_add(out, frames, hop, first=0):
+    n_frames, frame_length = frames.shape
+    start = first * hop
+    if frame_length % hop == 0:
+        for r in range(frame_length // hop):
+            block = slice(start + r * hop, start + r * hop + n_frames * hop)
+            out[block].reshape(n_frames, hop)[:] += frames[:, r * hop:(r + 1) * hop]
+    else:
+        index = start + np.arange(n_frames)[:, None] * hop + np.arange(frame_length)
+        np.add.at(out, index, frames)
+
+
+# The overlapped squared window of n frames, which weighted overlap-add divides by
+# input: number of frames, frame length and hop in samples (int), window (numpy array), output: numpy float array
+def window_weight(n_frames, frame_length, hop, window):
+    weight = np.zeros((n_frames - 1) * hop + frame_length)
+    overlap_add(weight, np.broadcast_to(window ** 2, (n_frames, frame_length)), hop)
+    return np.where(weight > 1e-8, weight, 1.0)
+
+
+# Inverse of stft: a batched irfft, then weighted overlap-add of every frame
+# input: spectrum (complex numpy array), frame length and hop in samples (int), window (numpy array,
+#        default hanning), number of samples to return (int, default all), output: samples (numpy float array)
+def istft(spectrum, frame_length=1024, hop=256, window=None, length=None):
+    if window is None:
+        window = np.hanning(frame_length)
+    frames = np.fft.irfft(spectrum, n=frame_length, axis=1) * window
+    out = np.zeros((len(frames) - 1) * hop + frame_length)
+    overlap_add(out, frames, hop)
+    out /= window_weight(len(frames), frame_length, hop, window)
+    out = out[frame_length // 2:]
+    return out[:length] if length is not None else out[:len(out) - frame_length // 2]
+
+
+# Change the duration of a signal without changing its pitch, with a phase vocoder:
+# the spectrum is sampled at fractional frame positions, magnitudes are interpolated and the
+# phase of every bin is advanced by its measured frequency, accumulated over the frames with a cumsum.
+# The output is made block by block (the phase is carried between blocks), so memory use does not
+# grow with the length of the signal, and it is not normalised, so its level matches the input.
+# input: samples (numpy array), factor (float, above 1 is faster/shorter), frame length and hop (int),
+#        window (numpy array, default hanning), output: samples (numpy float array, about len(data) / factor long)
+def phase_vocoder(data, factor, frame_length=1024, hop=256, window=None, block=1024):
+    if factor <= 0:
+        raise ValueError("Expected a positive time stretch factor")
+    if window is None:
+        window = np.hanning(frame_length)
+    pad = np.zeros(frame_length // 2)
+    frames = frame_signal(np.concatenate([pad, data, pad]), frame_length, hop)
+    n_bins = frame_length // 2 + 1
+    # phase advance of each bin over one hop, for a sinusoid at the bin's centre frequency
+    expected = 2 * np.pi * hop * np.arange(n_bins) / frame_length
+    # analysis positions, the frame after the last one is silent
+    steps = np.arange(0, len(frames), factor)
+    out = np.zeros((len(steps) - 1) * hop + frame_length)
+    phase_start = None
+    for first in range(0, len(steps), block):
+        positions = steps[first:first + block]
+        before = positions.astype(int)
+        alpha = (positions - before)[:, None]
+        lo, hi = before[0], before[-1] + 2
+        spectrum = np.fft.rfft(frames[lo:min(hi, len(frames))] * window, axis=1)
+        if hi > len(frames):
+            spectrum = np.concatenate([spectrum, np.zeros((hi - len(frames), n_bins), spectrum.dtype)])
+        magnitude = np.abs(spectrum)
+        angle = np.arctan2(spectrum.imag, spectrum.real)
+        before -= lo
+        # measured phase advance: the expected advance plus the deviation from it, wrapped to [-pi, pi]
+        advance = angle[before + 1] - angle[before] - expected
+        advance -= 2 * np.pi * np.round(advance / (2 * np.pi))
+        advance += expected
+        if phase_start is None:
+            phase_start = angle[0]
+        phase = np.empty((len(positions), n_bins))
+        phase[0] = phase_start
+        np.cumsum(advance[:-1], axis=0, out=phase[1:])
+        phase[1:] += phase_start
+        phase_start = phase[-1] + advance[-1]
+        level = magnitude[before]
+        level += alpha * (magnitude[before + 1] - level)
+        stretched = np.empty(phase.shape, np.complex128)
+        np.multiply(level, np.cos(phase), out=stretched.real)
+        np.multiply(level, np.sin(phase), out=stretched.imag)
+        frames_out = np.fft.irfft(stretched, n=frame_length, axis=1)
+        frames_out *= window
+        overlap_add(out, frames_out, hop, first)
+    out /= window_weight(len(steps), frame_length, hop, window)
+    return out[frame_length // 2:][:int(round(len(data) / float(factor)))]
+
+
+# Build the header of a PCM (or, with tag=WAVE_FORMAT_IEEE_FLOAT, float) RIFF/WAVE file
+# input: channels, rate, sample width in bytes, number of data bytes (None when it is not
+#        known yet, e.g. when streaming, in which case the sizes are set to their maximum), format tag
+# output: header (bytes)
+def wav_header(channels, rate, width, data_size=None, tag=WAVE_FORMAT_PCM):
+    if data_size is None:
+        data_size = riff_size = 0xFFFFFFFF - 36
+    else:
+        # an odd sized data chunk is followed by a pad byte, which the RIFF size includes
+        riff_size = data_size + data_size % 2
+    block_align = channels * width
+    return struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + riff_size, b'WAVE',
+                       b'fmt ', 16, tag, channels, rate, rate * block_align, block_align, width * 8,
+                       b'data', data_size)
+
+
+# Writes PCM samples to a file (or pipe) as they are produced, e.g. chunk by chunk from a
+# streaming synthesizer, so long renders never need to be held in memory
+#   f     - path, or an open binary file object (which is not closed by the writer)
+#   width - sample width in bytes, every appended array must have this item size
+#           (except 3 byte samples, which are appended as int32, see wav_samples)
+#   tag   - WAVE_FORMAT_IEEE_FLOAT for float samples
+class PcmWriter(object):
+
+    def __init__(self, f, channels=CHANNELS, rate=RATE, width=2, tag=WAVE_FORMAT_PCM):
+        self.chan = channels
+        self.rate = rate
+        self.width = width
+        self.tag = tag
+        self.frames = 0
+        self.owns_file = not hasattr(f, "write")
+        self.file = open(f, "wb") if self.owns_file else f
+        self.data_start = self.position()
+
+    # The current position in the file, or None if it can't seek (e.g. a pipe)
+    def position(self):
+        try:
+            return self.file.tell()
+        except (IOError, OSError, AttributeError, ValueError):
+            return None
+
+    # Write an array of samples, straight from its memory if it is contiguous
+    def append(self, data):
+        data = np.ascontiguousarray(data)
+        if data.dtype.itemsize != (4 if self.width == 3 else self.width):
+            raise ValueError("Expected %d byte samples, got %s" % (self.width, data.dtype))
+        self.file.write(np.ascontiguousarray(wav_samples(data, self.width)).data)
+        self.frames += len(data) // self.chan
+
+    def close(self):
+        if self.owns_file:
+            self.file.close()
+        else:
+            self.file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# As PcmWriter, but with a WAV header. The header is written first with placeholder
+# sizes, which are patched when the writer is closed. If the file can't seek, the
+# placeholders are the maximum sizes, which readers take as "read to the end".
+class WavWriter(PcmWriter):
+
+    def __init__(self, f, channels=CHANNELS, rate=RATE, width=2, tag=WAVE_FORMAT_PCM):
+        PcmWriter.__init__(self, f, channels, rate, width, tag)
+        self.header_start = self.data_start
+        self.file.write(wav_header(channels, rate, width, None if self.header_start is None else 0, tag))
+        self.data_start = self.position()
+
+    def close(self):
+        data_size = self.frames * self.chan * self.width
+        # the data chunk must be padded to an even number of bytes
+        if data_size % 2:
+            self.file.write(b'\0')
+        if self.header_start is not None:
+            end = self.position()
+            self.file.seek(self.header_start)
+            self.file.write(wav_header(self.chan, self.rate, self.width, data_size, self.tag))
+            self.file.seek(end)
+        PcmWriter.close(self)
+
+
+# A buffer of samples plus the format information needed to play or save them.
+# Audio objects are plain containers: the audio device is only used by the
+# stream methods below.
+class Audio(object):
 
     def __init__(self,channels=1,
                  rate=RATE,
                  chunk=CHUNK,
                  format=FORMAT):
-        # Initialise the parent class
-        pyaudio.PyAudio.__init__(self)
-
         # Set the format to that specified
         self.chan = channels
         self.rate = rate
@@ -38,35 +473,45 @@ class Audio(pyaudio.PyAudio):
         # No streams are open at the moment
         self.istream = None
         self.ostream = None
+        # the buffer getChunk records into (self.data is a view of it while recording)
+        self.input_buffer = None
         # a counter for referencing the data in chunks
         self.chunk_index = 0
 
-    def __del__(self):
-        self.terminate()
-
     # Get a chunk of data from the current input stream
+    # the chunks are copied into a buffer that doubles in size when it is full, with self.data
+    # a view of its filled part, so each chunk costs the same however long the recording is
     def getChunk(self):
         tmpstr = self.istream.read(self.chunk)
-        array = np.fromstring(tmpstr, dtype=self.nptype)
-        self.data = np.append(self.data,array)
+        array = np.frombuffer(tmpstr, dtype=self.nptype)
+        filled = len(self.data)
+        buffer = self.input_buffer
+        if buffer is None or self.data.base is not buffer or filled + len(array) > len(buffer):
+            # the buffer is full, or self.data has been replaced since the last chunk
+            buffer = np.empty(max(2 * (filled + len(array)), 16 * self.chunk * self.chan), dtype=self.nptype)
+            buffer[:filled] = self.data
+            self.input_buffer = buffer
+        buffer[filled:filled + len(array)] = array
+        self.data = buffer[:filled + len(array)]
     
     # Put a chunk of data to the current output stream        
     def putChunk(self):
         slice_from = self.chunk_index*self.chunk
-        slice_to = slice_from + self.chunk - 1
+        slice_to = slice_from + self.chunk
         # Slicing a numpy array out of bounds doesn't seem to raise an
         # index error, so we explcitly test and raise the error ourselves
-        if slice_to > self.data.shape[0]:
+        # (the last chunk may be shorter than self.chunk)
+        if slice_from >= self.data.shape[0]:
             raise IndexError
         array = self.data[slice_from:slice_to]
-        self.ostream.write(array.tostring())
+        self.ostream.write(array.tobytes())
         self.chunk_index += 1
         
     # Open an input stream
-    # We just call the inherited open function in the parent class 
+    # We just call the open function of the shared PortAudio connection
     # with the correct format data
     def openInputStream(self):
-        self.istream = self.open(format = self.format,
+        self.istream = get_pyaudio().open(format = self.stream_format(),
                                 channels = self.chan,
                                 rate = self.rate,
                                 input = True,
@@ -79,7 +524,7 @@ class Audio(pyaudio.PyAudio):
       
     # Open an output stream
     def openOutputStream(self):
-        self.ostream = self.open(format = self.format,
+        self.ostream = get_pyaudio().open(format = self.stream_format(),
                                  channels = self.chan,
                                  rate = self.rate,
                                  output = True)
@@ -90,88 +535,125 @@ class Audio(pyaudio.PyAudio):
         self.ostream.close()
         self.ostream = None
     
-    # Record data
-    def record(self, time=5.0):
-        # Clear current data
-        self.data = np.array([],dtype=self.nptype)
-        # Open an inputstream
-        self.openInputStream()
-        print "Recording..."
-        # Get time*sample_rate values in total, a chunk at a time
-        for i in range(0, int(time * self.rate/self.chunk) ):
-            self.getChunk()
-        print "Done Recording"
-        # Close the input stream
-        self.closeInputStream()
-
-    # Play the current data
-    def play(self):
-        # Open an outputstream
-        self.openOutputStream()
-        # Reset the chunk counter to 0
-        self.chunk_index = 0
-        print "Playing..."
-        # Loop (potentially forever)
-        while True:
-            # Try to put output a chunk
-            try:    
-                self.putChunk()
-            # If we run out of data to output, break out of the loop
-            except IndexError:
-                break
-        print "Stopped playing"
-        # Close the output stream
-        self.closeOutputStream()
-
-    # Save the data to a file
-    def save(self,path):
-        # Create a 'string' of the data
-        raw = self.data.tostring()
-        # Open the file for writing
-        wf = wave.open(path, 'wb')
-        # Set the header information
-        wf.setnchannels(self.chan)
-        wf.setsampwidth(self.get_sample_size(self.format))
-        wf.setframerate(self.rate)
-        # Write the data
-        wf.writeframes(raw)
-        # Close the file
-        wf.close()
-    
-    # Load data from a file    
-    def load(self,path):
-        # Open the file for reading
-        wf = wave.open(path,"rb")
-        # Get information from the files header
-        self.format = self.get_format_from_width(wf.getsampwidth())
-        self.nptype = self.getNpType(self.format)
-        self.chan = wf.getnchannels()
-        self.rate = wf.getframerate()
-        # Set the internal data attribute to an empty array of the right type
-        self.data = np.array([],dtype=self.nptype)
-        # Read a chunk of data from the file
-        raw = wf.readframes(self.chunk)
-        # Loop while there is data in the file
-        while raw != "":
-            # Convert the raw data to a numpy array
-            array = np.fromstring(raw, dtype=self.nptype)
-            # Append the array to the class data attribute
-            self.data = np.append(self.data,array)
-            # Read the next chunk, ready for the next loop iteration
-            raw = wf.readframes(self.chunk)
-        # Close the file
-        wf.close()
+    # Record data (blocks until time seconds have been recorded), see record_async
+    # returns the Recording handle, with the overrun counts
+    def record(self, time=5.0, device=None, outfile=None, buffer_chunks=64):
+        print("Recording...")
+        recording = self.record_async(time, device, outfile, buffer_chunks)
+        recording.wait()
+        print("Done Recording")
+        if recording.overruns or recording.dropped_frames:
+            print("%d overruns, %d frames dropped" % (recording.overruns, recording.dropped_frames))
+        return recording
+
+    # Start recording without blocking, see the Recording class
+    #   time    - length of the recording in seconds
+    #   device  - object with a pyaudio style open() (default: the shared PortAudio connection)
+    #   outfile - path or binary file object to stream the recording to as a WAV file, instead of
+    #             holding it in memory (with a path, self.data maps the file once recording ends)
+    # returns a Recording handle with wait(), stop() and progress()
+    def record_async(self, time=5.0, device=None, outfile=None, buffer_chunks=64):
+        return Recording(self, int(round(time * self.rate)), outfile, device, buffer_chunks)
+
+    # Play the current data (blocks until it has been played)
+    def play(self, device=None):
+        print("Playing...")
+        self.play_async(device=device).wait()
+        print("Stopped playing")
+
+    # Play chunks of data as they arrive, e.g. from a streaming synthesizer,
+    # so playback starts before the whole waveform exists (blocks until they have been played)
+    #   chunks - iterable of numpy arrays in this object's format
+    def play_stream(self, chunks, device=None):
+        self.play_async(chunks, device=device).wait()
+
+    # Start playing without blocking, see the Playback class
+    #   chunks - iterable of numpy arrays to play instead of self.data
+    #   device - object with a pyaudio style open() (default: the shared PortAudio connection)
+    # returns a Playback handle with wait(), stop() and progress()
+    def play_async(self, chunks=None, device=None, buffer_chunks=16):
+        if chunks is None:
+            chunks = [self.data]
+        return Playback(self, chunks, device, buffer_chunks)
+
+    # Save the data to a file (a path or an open binary file object)
+    #   format - sample format to write (default: the format of the data), e.g. paInt24,
+    #            the data is converted on the way out, see convert_samples
+    #   dither - add triangular dither when the conversion reduces the number of bits
+    def save(self,path,format=None,dither=False):
+        if format is None:
+            format = self.format
+        data = convert_samples(self.data, self.format, format, dither)
+        width = SAMPLE_FORMATS[format][1]
+        tag = WAVE_FORMAT_PCM if format_bits(format) else WAVE_FORMAT_IEEE_FLOAT
+        # Write the header and then the data, without making a copy of it
+        with WavWriter(path, self.chan, self.rate, width, tag) as wf:
+            wf.append(data)
     
-    # Convert the pyaudio data format type to the numpy type 
-    #  - This really needs expanding to deal with other data types, e.g. 8bit and 24bit audio
+    # Load data from a file (8, 16, 24 or 32 bit PCM, or 32 or 64 bit float)
+    #   mmap   - True maps the PCM payload straight into self.data (zero copy, pages are
+    #            only read when touched), False reads it in a single bulk read, and
+    #            None picks mmap for payloads of at least MMAP_THRESHOLD bytes
+    #            (8 and 24 bit and 64 bit float files are always read, they are converted as they load)
+    #   format - sample format to convert the data to (default: keep the format of the file),
+    #            e.g. paFloat32 to process it in floating point, see convert_samples
+    #   dither - add triangular dither when the conversion reduces the number of bits
+    def load(self,path,mmap=None,format=None,dither=False):
+        # Open the file and get information from its header
+        with open(path, "rb") as f:
+            self.chan, self.rate, width, offset, frames, tag = read_wav_format(f)
+            if tag == WAVE_FORMAT_IEEE_FLOAT and width in (4, 8):
+                self.format = paFloat32
+                file_type = np.float32 if width == 4 else np.float64
+            elif tag == WAVE_FORMAT_PCM and 1 <= width <= 4:
+                self.format = [paInt8, paInt16, paInt24, paInt32][width - 1]
+                file_type = {1: np.uint8, 2: np.int16, 3: np.uint8, 4: np.int32}[width]
+            else:
+                raise wave.Error("unsupported WAV format %d with %d byte samples" % (tag, width))
+            self.nptype = self.getNpType(self.format)
+            count = frames * self.chan * (3 if width == 3 else 1)
+            if file_type != self.nptype or width == 1:
+                mmap = False
+            elif mmap is None:
+                mmap = count * width >= MMAP_THRESHOLD
+            if not mmap:
+                # Read the whole payload at once
+                f.seek(offset)
+                self.data = np.fromfile(f, dtype=file_type, count=count)
+                if file_type != self.nptype or width == 1:
+                    self.data = from_wav_samples(self.data, width).astype(self.nptype, copy=False)
+            elif count == 0:
+                self.data = np.array([], dtype=self.nptype)
+            else:
+                # Copy-on-write mapping: the data can be modified in place without
+                # touching the file, and unmodified pages are shared between processes
+                self.data = np.memmap(path, dtype=self.nptype, mode='c', offset=offset, shape=(count,))
+        if format is not None:
+            self.to_format(format, dither)
+
+    # Convert the data to another sample format (a key of SAMPLE_FORMATS), see convert_samples
+    # e.g. to_format(paFloat32) before a chain of processing, and back to paInt16 at the end
+    def to_format(self, format, dither=False):
+        if self.getNpType(format) is None:
+            raise ValueError("unsupported sample format %r" % format)
+        self.data = convert_samples(self.data, self.format, format, dither)
+        self.format = format
+        self.nptype = self.getNpType(format)
+
+    # The format the audio device is opened with: 24 bit samples are held (and so streamed) as int32
+    def stream_format(self):
+        return paInt32 if self.format == paInt24 else self.format
+
+    # Convert the pyaudio data format type to the numpy type (None for formats missing from SAMPLE_FORMATS)
     def getNpType(self,type):
-         if type == pyaudio.paInt16:
-             return np.int16
+        if type in SAMPLE_FORMATS:
+            return SAMPLE_FORMATS[type][0]
     
     # Convert the numpy data format type to the pyaudio type    
     def getPaType(self,type):
-            if type == np.int16:
-                return pyaudio.paInt16
+        for format in [paInt8, paInt16, paInt32, paFloat32]:
+            if np.dtype(type) == SAMPLE_FORMATS[format][0]:
+                return format
     
     # Add an echo the the current audio data
     #   repeat - How many delayed repeats to add
@@ -180,11 +662,12 @@ class Audio(pyaudio.PyAudio):
         # get the length of the existing data
         length = self.data.shape[0]
         # create a new array with the required extra length
-        array = np.zeros(length + repeat*delay, dtype=self.nptype)
-
         # loop for the number of delays + 1
         #  - we use the 0th iteration of the loop to reduce the amplitude of the original
         #    waveform, so when we add to it we don't 'clip'
+        #  - the sum is built in floating point and clipped once at the end, adding
+        #    into the integer array directly would wrap around
+        array = np.zeros(length + repeat*delay, dtype=work_type(self.nptype))
         for i in range(0,repeat+1):
             # Get start and end times for the current offset
             start = i*delay
@@ -192,49 +675,52 @@ class Audio(pyaudio.PyAudio):
             # Calculate the current scaling factor
             scale = 2**(i+1)
             # Add a scaled version of self.data to 'window' of the new array
-            array[start:end] += self.data / scale
+            array[start:end] += self.data * array.dtype.type(1.0 / scale)
         # Set the class data attribute to the new array
-        self.data = array
+        self.data = to_type(array, self.nptype)
 
+    # Scale the data so its biggest peak is val * full scale (MAX_AMP for int16)
+    # (a peak of exactly full scale is clipped to the largest value an integer type can hold)
     def rescale(self,val):
         # Check arguement passed
         if not 0<=val<=1:
-            raise ValueError, "Expected scaling factor between 0 and 1"
-        # find the biggest peak
-        peak = 0
-        length = self.data.shape[0]
-        for i in range(0,length-1):
-            if abs(self.data[i]) > peak:
-                peak = abs(self.data[i])
+            raise ValueError("Expected scaling factor between 0 and 1")
+        # find the biggest peak (without abs(), which overflows for the most negative value)
+        if len(self.data) == 0:
+            return
+        peak = max(float(self.data.max()), -float(self.data.min()))
+        # silence has no peak to scale to, so it stays as it is
+        if peak == 0:
+            return
         # Calculate the rescaling factor
-        rescale_factor = val*MAX_AMP/float(peak)
+        rescale_factor = val*self.full_scale()/peak
         # Create a new array of floats for the rescaling
-        array = np.zeros(length,np.float)
-        array += self.data
-        array *= rescale_factor
+        array = np.multiply(self.data, rescale_factor, dtype=work_type(self.nptype))
         # set the class data attribute to the rescaled version
-        self.data = array.astype(self.nptype)
+        self.data = to_type(array, self.nptype)
     
 
     def create_tone(self,frequency,length,amplitude):
         if not 0<=amplitude<=1:
-            raise ValueError, "Expected amplitude between 0 and 1"
+            raise ValueError("Expected amplitude between 0 and 1")
 
+        s = np.arange(length, dtype=np.float64)
+        s *= frequency*2*math.pi/self.rate
+        np.sin(s, out=s)
+        s *= amplitude*self.full_scale()
+        self.data = to_type(s, self.nptype)
 
-        s = np.zeros(length,self.nptype)
-        for i in range(0,length):
-            s[i] = amplitude*MAX_AMP*math.sin(frequency*i*2*math.pi/self.rate)
-        self.data=s
-
-    def create_noise(self,length,amplitude):
+    # Create uniform noise between 0 and amplitude
+    #   seed - seed for the random number generator, so the noise can be reproduced
+    #          (None gives different noise every time)
+    def create_noise(self,length,amplitude,seed=None):
 
         if not 0<=amplitude<=1:
-            raise ValueError, "Expected amplitude between 0 and 1"
+            raise ValueError("Expected amplitude between 0 and 1")
 
-        s = np.zeros(length,self.nptype)
-        for i in range(0,length):
-            s[i] = amplitude*MAX_AMP*random.random()
-        self.data = s
+        s = np.random.RandomState(seed).random_sample(length)
+        s *= amplitude*self.full_scale()
+        self.data = to_type(s, self.nptype)
 
     # This version adds to the existing object. 
     # Cons of this approach: changes the original object, 
@@ -243,23 +729,18 @@ class Audio(pyaudio.PyAudio):
     def add(self,other):
         # Find the length of the longest
         length = max(self.data.shape[0],other.data.shape[0])
-        # Create an empty array of this length
-        array = array = np.zeros(length, dtype=self.nptype)
-        # Add in each data at half amplitute (so it doesn't clip)
-        array += self.data / 2.0
-        array += other.data / 2.0
+        # Create an empty array of this length (of floats, so the sum can't wrap around)
+        array = np.zeros(length, dtype=work_type(self.nptype))
+        # Add in each data at half amplitute (so it doesn't clip), in this object's format
+        array[:self.data.shape[0]] += self.data * array.dtype.type(0.5)
+        array[:other.data.shape[0]] += convert_samples(other.data, other.format, self.format) * array.dtype.type(0.5)
         # Update the stored array in the current object.
-        self.data = array
+        self.data = to_type(array, self.nptype)
 
     def reverse(self):
-        # get the length of the array and create a new array of zeros
-        length = self.data.shape[0]
-        array = np.zeros(length,dtype=self.nptype)
-        # index over the range of the array
-        for i in range(0,length):
-            # set the ith item of the array to (length-1)-ith item
-            array[i] = self.data[length-1-i]
-        self.data = array
+        # copy the array backwards in one go
+        # (unlike reverse_npindex the result doesn't share memory with the original)
+        self.data = self.data[::-1].copy()
 
 
     def reverse_npindex(self):
@@ -270,8 +751,7 @@ class Audio(pyaudio.PyAudio):
         return self.data.shape[0]
 
     def get_samplerange(self):
-        if self.nptype == np.int16:
-            return math.pow(2, 16)
+        return 2 * self.full_scale()
 
     # Convert time to samples
     def time_to_samples(self,time):
@@ -281,46 +761,104 @@ class Audio(pyaudio.PyAudio):
     def samples_to_time(self, samples):
         return float(samples) / self.rate
 
+    # Magnitude spectrum of the samples from start to end, windowed before the transform
     def compute_fft(self, start, end):
-        dur = end - start
-        fft = pl.fft(self.data[start:end])
-        real_range = np.ceil((dur+1)/2.0)
-        fft = fft[0:real_range]
-        fft = abs(fft)
+        window = self.data[start:end]
+        return np.abs(np.fft.rfft(window * np.hanning(len(window))))
 
-        return fft * np.hanning(len(fft))
+    # Magnitude spectrogram of the whole buffer in one batched transform, see stft
+    # output: numpy array (frames x (frame_length // 2 + 1))
+    def spectrogram(self, frame_length=1024, hop=256, window=None):
+        return np.abs(stft(self.data, frame_length, hop, window))
 
-    def change_speed(self, factor):
-        indxs = np.round( np.arange(0, len(self.data), factor) )
-        indxs = indxs[indxs < len(self.data)].astype(int)
-        self.data = self.data[indxs]
+    # The magnitude of a full scale sample
+    def full_scale(self):
+        if np.issubdtype(self.nptype, np.integer):
+            return float(np.iinfo(self.nptype).max) + 1
+        return 1.0
 
+    # The magnitude from which a sample counts as clipped: the largest value of integer
+    # samples, full scale (or beyond) for float samples
+    def clip_level(self):
+        if np.issubdtype(self.nptype, np.integer):
+            return self.full_scale() - 1
+        return 1.0
 
-    def time_stretch_fft(self, factor, windowsize=1024, overlap=512, apply_hanning=True):
-        phase = np.zeros(windowsize)
-        if apply_hanning:
-            amp_window = np.hanning(windowsize)
-        else:
-            amp_window = np.ones(windowsize, dtype=np.float)
-        result = np.zeros( int(len(self.data) / factor + windowsize))
+    # Level statistics of every frame, computed for all frames at once
+    # output: dict of numpy arrays: rms and peak (fractions of full scale), clipped (number of samples at full scale)
+    def frame_stats(self, frame_length=1024, hop=512):
+        frames = frame_signal(self.data, frame_length, hop)
+        scale = self.full_scale()
+        magnitude = np.abs(frames)
+        return {"rms": np.sqrt(np.mean(np.square(frames), axis=1)) / scale,
+                "peak": magnitude.max(axis=1) / scale,
+                "clipped": np.count_nonzero(magnitude >= self.clip_level(), axis=1)}
 
-        for i in np.arange(0, len(self.data)-(windowsize+overlap), overlap*factor, dtype=np.int):
-            a1 = self.data[i: i + windowsize]
-            a2 = self.data[i + overlap: i + windowsize + overlap]
+    # Summary of the levels of the whole buffer, for quality checks of rendered audio
+    #   silence_db - frames whose rms is below this level (dB relative to full scale) count as silent
+    # output: dict of duration (seconds), rms and peak (fractions of full scale),
+    #         clipped (number of samples at full scale) and silence_ratio (fraction of silent frames)
+    def summary(self, frame_length=1024, hop=512, silence_db=-50.0):
+        samples = self.data.astype(np.float64)
+        scale = self.full_scale()
+        stats = self.frame_stats(frame_length, hop)
+        return {"duration": self.samples_to_time(len(self.data) // self.chan),
+                "rms": float(np.sqrt(np.mean(np.square(samples)))) / scale if len(samples) else 0.0,
+                "peak": float(np.abs(samples).max()) / scale if len(samples) else 0.0,
+                "clipped": int(np.count_nonzero(np.abs(samples) >= self.clip_level())),
+                "silence_ratio": float(np.mean(stats["rms"] < 10 ** (silence_db / 20.0))) if len(samples) else 1.0}
 
-            s1 = np.fft.fft(amp_window * a1)
-            s2 = np.fft.fft(amp_window * a2)
-            phase = (phase + np.angle(s2/s1)) % 2*np.pi
-            a2_rephased = np.fft.ifft(np.abs(s2)*np.exp(1j*phase))
+    # Compare the audio either side of each join (e.g. the phone boundaries from Synth.join_positions),
+    # with the windows of every join gathered and transformed at once
+    #   positions - sample index of the first sample after each join
+    #   width     - number of samples compared on each side
+    # output: dict of numpy arrays: position, rms_before and rms_after (fractions of full scale),
+    #         jump (difference of the samples either side, fraction of full scale) and
+    #         spectral_distance (rms difference of the two sides' log spectra, in dB)
+    def join_summary(self, positions, width=256):
+        positions = np.asarray(positions, dtype=int)
+        positions = positions[(positions > 0) & (positions < len(self.data))]
+        scale = self.full_scale()
+        padded = np.concatenate([np.zeros(width), self.data.astype(np.float64), np.zeros(width)]) / scale
+        index = positions[:, None] + np.arange(width)  # window before the join, in padded coordinates
+        before, after = padded[index], padded[index + width]
+        window = np.hanning(width)
+        spectra = 20 * np.log10(np.abs(np.fft.rfft(np.stack([before, after]) * window, axis=2)) + 1e-6)
+        return {"position": positions,
+                "rms_before": np.sqrt(np.mean(np.square(before), axis=1)),
+                "rms_after": np.sqrt(np.mean(np.square(after), axis=1)),
+                "jump": np.abs(padded[positions + width] - padded[positions + width - 1]),
+                "spectral_distance": np.sqrt(np.mean(np.square(spectra[0] - spectra[1]), axis=1))}
 
-            i2 = int(i/factor)
-            result[i2 : i2 + windowsize] += amp_window*np.real(a2_rephased)
-        result = ((2**(16-4)) * result/result.max())
+    # Convert the audio to another sample rate, see resample_poly
+    # (the channels of interleaved data are resampled separately)
+    def resample(self, rate):
+        if rate == self.rate:
+            return
+        frames = self.data.reshape(-1, self.chan)
+        resampled = np.stack([resample_poly(frames[:, c], int(rate), int(self.rate)) for c in range(self.chan)], axis=1)
+        self.data = to_type(resampled.ravel(), self.nptype, rounding=True)
+        self.rate = int(rate)
+
+    def change_speed(self, factor):
+        indxs = np.round( np.arange(0, len(self.data), factor) )
+        indxs = indxs[indxs < len(self.data)].astype(int)
+        self.data = self.data[indxs]
 
-        self.data = result.astype(self.nptype)
 
+    # Change the duration without changing the pitch, see phase_vocoder
+    # (factor above 1 is faster; overlap is the number of samples consecutive windows share)
+    def time_stretch_fft(self, factor, windowsize=1024, overlap=768, apply_hanning=True):
+        window = np.hanning(windowsize) if apply_hanning else np.ones(windowsize)
+        frames = self.data.reshape(-1, self.chan)
+        stretched = np.stack([phase_vocoder(frames[:, c], factor, windowsize, windowsize - overlap, window)
+                              for c in range(self.chan)], axis=1)
+        self.data = to_type(stretched.ravel(), self.nptype, rounding=True)
 
+
+    # pylab (all of matplotlib) is imported by the plot methods, the first time one is called
     def plot_waveform(self, start=0, end=-1, x_unit="samples"):
+        import pylab as pl
         array = self.data[start:end]
         num_samples = len(array)
         if x_unit == "samples":
@@ -337,9 +875,10 @@ class Audio(pyaudio.PyAudio):
         pl.show()
 
     def plot_spectrum(self, array, start=0, end=-1, plot_log=False):
+        import pylab as pl
         array = array[start:end]
         len_arr = len(array)
-        #print len_arr
+        #print(len_arr)
         freq_axis = np.arange(0, len_arr, 1.0) #* (self.rate / len_arr)
         if plot_log:
             pl.plot(freq_axis/1000, 10*np.log10(array), color='k')
@@ -351,6 +890,323 @@ class Audio(pyaudio.PyAudio):
 
 
 
+# A fixed size ring buffer of samples, filled by one thread and emptied by another.
+# The buffer is allocated once; write() blocks while it is full, read() never blocks
+# (it is called from the audio callback) and returns however many samples are ready.
+class RingBuffer(object):
+
+    def __init__(self, size, dtype=np.int16):
+        self.buffer = np.zeros(size, dtype=dtype)
+        self.size = size
+        # total number of samples written and read so far (positions are taken modulo size)
+        self.write_count = 0
+        self.read_count = 0
+        # set by the writer when it has nothing more to write
+        self.finished = False
+        # set when the reader has gone away, so the writer must not wait for space
+        self.closed = False
+        self.cond = threading.Condition()
+
+    # Number of samples waiting to be read
+    def available(self):
+        with self.cond:
+            return self.write_count - self.read_count
+
+    # Copy all of data into the buffer, waiting for space as needed
+    # (or, with block=False, only as much as there is space for now)
+    # returns the number of samples written (less than len(data) only if the buffer was closed, or full)
+    def write(self, data, block=True):
+        written = 0
+        with self.cond:
+            while written < len(data):
+                while self.write_count - self.read_count == self.size and not self.closed and block:
+                    self.cond.wait()
+                if self.closed or self.write_count - self.read_count == self.size:
+                    break
+                start = self.write_count % self.size
+                count = min(len(data) - written, self.size - (self.write_count - self.read_count), self.size - start)
+                self.buffer[start:start + count] = data[written:written + count]
+                self.write_count += count
+                written += count
+                self.cond.notify_all()
+        return written
+
+    # Copy up to len(out) samples into out, returns the number copied
+    def read(self, out):
+        with self.cond:
+            count = min(len(out), self.write_count - self.read_count)
+            start = self.read_count % self.size
+            first = min(count, self.size - start)
+            out[:first] = self.buffer[start:start + first]
+            out[first:count] = self.buffer[:count - first]
+            self.read_count += count
+            self.cond.notify_all()
+        return count
+
+    # Wait until at least count samples can be read or the writer has finished
+    def wait_available(self, count):
+        with self.cond:
+            while self.write_count - self.read_count < count and not (self.finished or self.closed):
+                self.cond.wait()
+
+    # Wait until the buffer is full or the writer has finished
+    def wait_full(self):
+        with self.cond:
+            while self.write_count - self.read_count < self.size and not (self.finished or self.closed):
+                self.cond.wait()
+
+    # Mark the end of the data
+    def finish(self):
+        with self.cond:
+            self.finished = True
+            self.cond.notify_all()
+
+    # Stop any writer waiting for space
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+# Handle on audio being played in the background by Audio.play_async.
+# A producer thread copies the data (or each chunk of a stream, as it is generated) into a
+# preallocated ring buffer, and the output device pulls from the ring buffer through a
+# PortAudio callback, so the caller is free to do other work (e.g. render the next utterance).
+# Every sample is delivered; if the producer falls behind, silence is inserted and counted in underruns.
+# Any object with a pyaudio style open(..., stream_callback=...) can be used as the device,
+# which is how playback can be tested without sound hardware.
+class Playback(object):
+
+    def __init__(self, audio, chunks, device=None, buffer_chunks=16):
+        self.chan = audio.chan
+        self.nptype = audio.nptype
+        self.chunk = audio.chunk
+        self.ring = RingBuffer(buffer_chunks * audio.chunk * audio.chan, audio.nptype)
+        # reused by every callback, so the callback doesn't allocate sample buffers
+        self.out = np.zeros(audio.chunk * audio.chan, dtype=audio.nptype)
+        self.frames_played = 0
+        self.frames_total = None    # known up front for arrays, for a stream once the producer has seen all of it
+        if isinstance(chunks, (list, tuple)):
+            self.frames_total = int(np.sum([len(chunk) for chunk in chunks])) // self.chan
+        self.underruns = 0
+        self.error = None           # exception raised by the producer, re-raised by wait()
+        self.done = threading.Event()
+        self.producer = threading.Thread(target=self.produce, args=(chunks,))
+        self.producer.daemon = True
+        self.producer.start()
+        # let the producer fill the buffer before the device starts pulling from it
+        self.ring.wait_full()
+        if device is None:
+            device = get_pyaudio()
+        try:
+            self.stream = device.open(format = audio.stream_format(),
+                                      channels = audio.chan,
+                                      rate = audio.rate,
+                                      output = True,
+                                      frames_per_buffer = audio.chunk,
+                                      stream_callback = self.callback)
+        except BaseException:
+            # nothing will ever read the ring buffer, so release the producer
+            self.stream = None
+            self.ring.close()
+            raise
+
+    # Producer thread: feed the ring buffer
+    def produce(self, chunks):
+        total = 0
+        try:
+            for chunk in chunks:
+                chunk = np.asarray(chunk, dtype=self.nptype)
+                if self.ring.write(chunk) < len(chunk):
+                    break
+                total += len(chunk)
+        except BaseException as e:
+            self.error = e
+        if self.frames_total is None:
+            self.frames_total = total // self.chan
+        self.ring.finish()
+
+    # PortAudio callback: hand the device the next frame_count frames
+    def callback(self, in_data, frame_count, time_info, status):
+        wanted = frame_count * self.chan
+        if wanted > len(self.out):
+            self.out = np.zeros(wanted, dtype=self.nptype)
+        out = self.out[:wanted]
+        finished = self.ring.finished
+        got = self.ring.read(out)
+        out[got:] = 0
+        self.frames_played += got // self.chan
+        if got < wanted:
+            if finished or self.done.is_set():
+                self.done.set()
+                return (out.tobytes(), paComplete)
+            self.underruns += 1
+        return (out.tobytes(), paContinue)
+
+    # Fraction of the audio played so far (None while the length of a stream is still unknown)
+    def progress(self):
+        if self.frames_total is None:
+            return None
+        if self.frames_total == 0:
+            return 1.0
+        return min(1.0, float(self.frames_played) / self.frames_total)
+
+    # Wait for playback to finish (or for timeout seconds), returns True if it has finished
+    def wait(self, timeout=None):
+        if not self.done.wait(timeout):
+            return False
+        self.close()
+        if self.error is not None:
+            raise self.error
+        return True
+
+    # Stop playback now, discarding anything not played yet
+    def stop(self):
+        self.done.set()
+        self.ring.close()
+        self.close()
+
+    def close(self):
+        if self.stream is not None:
+            # let the device play out what it has already been given
+            while self.stream.is_active() and not self.ring.closed:
+                time.sleep(0.01)
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+        self.ring.close()
+        self.producer.join()
+
+
+# Handle on audio being recorded in the background by Audio.record_async.
+# The input device hands over each captured chunk through a PortAudio callback, which copies it
+# either into a buffer preallocated for the whole recording, or (with an outfile) into a ring
+# buffer of buffer_chunks chunks that a writer thread drains into a WAV file, so memory use
+# doesn't grow with the length of the recording. Either way every chunk costs the same.
+# The callback never allocates or waits: chunks the device flags as overflowed (samples were lost
+# before they reached the callback) are counted in overruns, and samples the ring buffer had no room
+# for (the writer fell behind) are dropped and counted in dropped_frames.
+# Any object with a pyaudio style open(..., input=True, stream_callback=...) can be used as the device,
+# which is how recording can be tested without sound hardware.
+class Recording(object):
+
+    def __init__(self, audio, frames, outfile=None, device=None, buffer_chunks=64):
+        self.audio = audio
+        self.chan = audio.chan
+        self.nptype = audio.nptype
+        self.frames_total = frames
+        self.frames_recorded = 0
+        self.overruns = 0
+        self.dropped_frames = 0
+        self.outfile = outfile
+        self.error = None           # exception raised by the writer, re-raised by wait()
+        self.done = threading.Event()
+        self.writer = None
+        if outfile is None:
+            self.buffer = np.empty(frames * audio.chan, dtype=audio.nptype)
+            self.ring = None
+        else:
+            self.buffer = None
+            self.ring = RingBuffer(buffer_chunks * audio.chunk * audio.chan, audio.nptype)
+            self.wav = WavWriter(outfile, audio.chan, audio.rate, SAMPLE_FORMATS[audio.format][1],
+                                 WAVE_FORMAT_PCM if format_bits(audio.format) else WAVE_FORMAT_IEEE_FLOAT)
+            block = min(16 * audio.chunk * audio.chan, self.ring.size)
+            self.writer = threading.Thread(target=self.write_file, args=(block,))
+            self.writer.daemon = True
+            self.writer.start()
+        if frames == 0:
+            self.done.set()
+            self.stream = None
+            return
+        if device is None:
+            device = get_pyaudio()
+        try:
+            self.stream = device.open(format = audio.stream_format(),
+                                      channels = audio.chan,
+                                      rate = audio.rate,
+                                      input = True,
+                                      frames_per_buffer = audio.chunk,
+                                      stream_callback = self.callback)
+        except BaseException:
+            # nothing will ever fill the ring buffer, so release the writer
+            self.stream = None
+            self.done.set()
+            self.close()
+            raise
+
+    # PortAudio callback: store the frame_count frames the device has captured
+    def callback(self, in_data, frame_count, time_info, status):
+        if status & INPUT_OVERFLOW:
+            self.overruns += 1
+        data = np.frombuffer(in_data, dtype=self.nptype)[:(self.frames_total - self.frames_recorded) * self.chan]
+        if self.ring is None:
+            start = self.frames_recorded * self.chan
+            self.buffer[start:start + len(data)] = data
+        else:
+            self.dropped_frames += (len(data) - self.ring.write(data, block=False)) // self.chan
+        self.frames_recorded += len(data) // self.chan
+        if self.frames_recorded >= self.frames_total or self.done.is_set():
+            self.done.set()
+            return (None, paComplete)
+        return (None, paContinue)
+
+    # Writer thread: drain the ring buffer into the WAV file, block samples at a time
+    def write_file(self, block):
+        out = np.empty(block, dtype=self.nptype)
+        try:
+            while True:
+                self.ring.wait_available(block)
+                count = self.ring.read(out)
+                if count:
+                    self.wav.append(out[:count])
+                elif self.ring.finished or self.ring.closed:
+                    break
+        except BaseException as e:
+            self.error = e
+            # nothing will drain the ring buffer any more, later chunks are dropped
+            self.ring.close()
+        finally:
+            self.wav.close()
+
+    # Fraction of the recording made so far
+    def progress(self):
+        if self.frames_total == 0:
+            return 1.0
+        return min(1.0, float(self.frames_recorded) / self.frames_total)
+
+    # Wait for the recording to finish (or for timeout seconds), returns True if it has finished
+    # the recording is then in the Audio object's data
+    def wait(self, timeout=None):
+        if not self.done.wait(timeout):
+            return False
+        self.close()
+        if self.error is not None:
+            raise self.error
+        return True
+
+    # Stop recording now, keeping what has been recorded so far
+    def stop(self):
+        self.done.set()
+        self.close()
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+        if self.ring is not None:
+            self.ring.finish()
+            self.writer.join()
+            self.ring = None
+            if hasattr(self.outfile, "write") or self.error is not None:
+                self.audio.data = np.array([], dtype=self.nptype)
+            else:
+                self.audio.load(self.outfile, mmap=True)
+        elif self.buffer is not None:
+            self.audio.data = self.buffer[:self.frames_recorded * self.chan]
+            self.buffer = None
+
+
 # This version uses a function just defined in the module namespace (i.e. not a method of the class),
 # and takes one argument that is a list of audio objects. This allows an arbitrary number of objects and uniform scaling
 def sum(audio_objects):
@@ -361,17 +1217,19 @@ def sum(audio_objects):
     # Work out the required scaling factor to prevent clipping
     scale = 1.0/len(audio_objects)
 
-    # make an array of zeros
-    # - should really check that the dtype of each of the objects is the same and use that dtype!
-    array = np.zeros(length, dtype=np.int16)
+    # make an array of zeros (of floats, so the sum can't wrap around),
+    # the result has the format of the first object and the others are converted to it
+    format = audio_objects[0].format
+    nptype = audio_objects[0].nptype
+    array = np.zeros(length, dtype=work_type(nptype))
     
     # Add each audio_object to the array
     for obj in audio_objects:
-        array += obj.data * scale
+        array[:len(obj)] += convert_samples(obj.data, obj.format, format) * array.dtype.type(scale)
     
     # Create a new object to return
-    new_object = Audio()
-    new_object.data = array
+    new_object = Audio(format=format)
+    new_object.data = to_type(array, nptype)
     
     return new_object
     
@@ -390,7 +1248,66 @@ def testAdd():
         
     chord.play()
         
-        
+
+def testSummary():
+    for format in (paInt16, paFloat32):
+        a = Audio(format=format)
+        a.create_tone(440, 16000, 0.5)
+        assert a.summary()["clipped"] == 0
+        assert a.frame_stats()["clipped"].sum() == 0
+        a.data[:10] = a.clip_level()
+        assert a.summary()["clipped"] == 10
+        assert a.frame_stats()["clipped"].sum() == 10
+
+
+# Output device that hands its stream callback to the caller instead of a sound card,
+# so playback can be driven one buffer at a time and the delivered samples checked
+class FakeOutputDevice(object):
+
+    def __init__(self):
+        self.callback = None
+        self.frames_per_buffer = None
+
+    def open(self, format, channels, rate, output, frames_per_buffer, stream_callback):
+        self.frames_per_buffer = frames_per_buffer
+        self.callback = stream_callback
+        return self
+
+    def is_active(self):
+        return False
+
+    def stop_stream(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def testPlayback():
+    a = Audio()
+    # longer than the ring buffer, and not a whole number of buffers
+    a.data = np.arange(10000, dtype=np.int16)
+    device = FakeOutputDevice()
+    playback = a.play_async(device=device)
+    played = []
+    while True:
+        # pull only once the producer has caught up, as a real device would after its latency
+        playback.ring.wait_available(device.frames_per_buffer)
+        data, flag = device.callback(None, device.frames_per_buffer, {}, 0)
+        played.append(np.frombuffer(data, dtype=np.int16))
+        if flag == paComplete:
+            break
+    playback.wait()
+    played = np.concatenate(played)
+    n_buffers = -(-len(a.data) // device.frames_per_buffer)
+    assert len(played) == n_buffers * device.frames_per_buffer
+    assert np.array_equal(played[:len(a.data)], a.data)
+    assert not played[len(a.data):].any()
+    assert playback.underruns == 0
+    assert playback.frames_played == len(a.data)
+    assert playback.progress() == 1.0
+
+
 if __name__ == "__main__":
     pass
     #testAdd()
@@ -0,0 +1,207 @@
+import argparse
+import asyncio
+import concurrent.futures
+import functools
+import os
+import threading
+import synthesizer
+import lexicon
+import cache
+import lts
+
+##############################################################################
+# Asyncio synthesis API (python 3.7+)                                        #
+# lets an asyncio service synthesise without blocking its event loop:       #
+# every blocking stage (voice and lexicon loading, normalisation, lookup,   #
+# concatenation, cache and file I/O) runs on an executor, and at most       #
+# max_concurrency requests are rendered at once. Further requests wait for  #
+# a slot (backpressure); with max_waiting set, requests beyond that many    #
+# waiting are rejected with SynthesisBusy instead of queueing without end.  #
+# The executor must share memory with the loop (a thread pool): the Synth   #
+# object is shared by every request, as in server.py.                       #
+#   synth = await AsyncSynthesizer.load("monophones", max_concurrency=4)    #
+#   audio = await synth.synthesize("hello world", volume=0.8)               #
+#   await synth.save(audio, "out.wav")                                      #
+##############################################################################
+
+
+"""
+Synthesis busy class
+raised when a request finds max_waiting requests already waiting for a slot
+"""
+class SynthesisBusy(RuntimeError):
+    pass
+
+
+"""
+Async synthesizer class
+object in the class renders requests for one loaded voice on an executor,
+with a limit on the number rendered at once
+"""
+class AsyncSynthesizer(object):
+    def __init__(self, synth, max_concurrency=4, max_waiting=None, executor=None, utterance_cache=None):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.synth = synth                  # synthesizer.Synth object shared by every request
+        self.cache = utterance_cache        # cache.UtteranceCache or None
+        self.max_concurrency = max_concurrency
+        self.max_waiting = max_waiting      # None to let any number of requests wait
+        # a pool of its own when none is given, one thread per slot
+        self.owns_executor = executor is None
+        self.executor = executor or concurrent.futures.ThreadPoolExecutor(max_concurrency)
+        self.semaphore = None               # created on first use, in the loop that uses it
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.lock = threading.Lock()        # the counters are updated from executor threads too
+
+    # function that loads a voice (and the lexicon) on an executor and wraps it, see __init__
+    # input: path of monophone folder or bank (string), synthesis rate (int), word memo size in bytes (int),
+    #        the arguments of __init__, output: AsyncSynthesizer object
+    @classmethod
+    async def load(cls, wav_folder, rate=16000, memo_bytes=synthesizer.WORD_MEMO_BYTES, **options):
+        executor = options.get("executor")
+        loop = asyncio.get_running_loop()
+        synth = await loop.run_in_executor(executor, functools.partial(
+            synthesizer.Synth, wav_folder=wav_folder, rate=rate, memo_bytes=memo_bytes))
+        await loop.run_in_executor(executor, lexicon.get_lexicon)
+        return cls(synth, **options)
+
+    # function that waits for a free slot, or raises SynthesisBusy if too many requests are waiting already
+    async def acquire(self):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        with self.lock:
+            if self.semaphore.locked() and self.max_waiting is not None and self.waiting >= self.max_waiting:
+                self.rejected += 1
+                raise SynthesisBusy("%d requests are already waiting" % self.waiting)
+            self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            with self.lock:
+                self.waiting -= 1
+        with self.lock:
+            self.active += 1
+
+    # function that frees a slot, must be called from the loop's thread
+    def release(self):
+        with self.lock:
+            self.active -= 1
+            self.completed += 1
+        self.semaphore.release()
+
+    # function that runs a blocking function on the executor in a slot of its own
+    # the slot is held until the function returns, even if the waiting task is cancelled,
+    # so cancelled requests can't push the number of renders past the limit
+    # input: function and its arguments, output: the result of the function
+    async def run(self, fn, *args, **kwargs):
+        await self.acquire()
+        loop = asyncio.get_running_loop()
+        try:
+            future = self.executor.submit(functools.partial(fn, *args, **kwargs))
+        except BaseException:
+            self.release()
+            raise
+        future.add_done_callback(lambda f: loop.call_soon_threadsafe(self.release))
+        return await asyncio.wrap_future(future)
+
+    # function that synthesises a phrase, see synthesizer.synthesize
+    # input: phrase (string), spell flag (bool), volume between 0.0 and 1.0 or None (float),
+    #        speaking rate (float or None), output: synthesised audio (Audio object)
+    async def synthesize(self, phrase, spell=False, volume=None, speaking_rate=None):
+        return await self.run(synthesizer.synthesize, self.synth, phrase, spell=spell, volume=volume,
+                              cache=self.cache, speaking_rate=speaking_rate)
+
+    # function that synthesises a phrase incrementally, see synthesizer.stream_synthesis
+    # the slot is held until the last chunk has been rendered (or the generator is closed)
+    # input: as synthesize, and the chunk size in samples (int)
+    # output: async iterator of audio data chunks (numpy arrays)
+    async def stream(self, phrase, spell=False, volume=None, speaking_rate=None, chunk_size=4096):
+        await self.acquire()
+        loop = asyncio.get_running_loop()
+        try:
+            chunks = await loop.run_in_executor(self.executor, functools.partial(
+                synthesizer.stream_synthesis, self.synth, phrase, spell=spell, volume=volume,
+                chunk_size=chunk_size, speaking_rate=speaking_rate))
+            while True:
+                chunk = await loop.run_in_executor(self.executor, next, chunks, None)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            self.release()
+
+    # function that saves audio to a file on the executor, outside the concurrency limit
+    # input: Audio object, path or binary file object, output: none
+    async def save(self, audio, path):
+        await asyncio.get_running_loop().run_in_executor(self.executor, audio.save, path)
+
+    # function that synthesises a phrase and saves it, see synthesize
+    # input: phrase (string), path (string) and the options of synthesize, output: synthesised audio (Audio object)
+    async def synthesize_to_file(self, phrase, path, **options):
+        audio = await self.synthesize(phrase, **options)
+        await self.save(audio, path)
+        return audio
+
+    # function that reports the slot usage
+    # output: dict
+    def stats(self):
+        with self.lock:
+            stats = {"max_concurrency": self.max_concurrency,
+                     "max_waiting": self.max_waiting,
+                     "active": self.active,
+                     "waiting": self.waiting,
+                     "completed": self.completed,
+                     "rejected": self.rejected}
+        if self.cache is not None:
+            stats["cache"] = self.cache.stats()
+        return stats
+
+    # function that shuts down the executor, if it was created by this object
+    def close(self):
+        if self.owns_executor:
+            self.executor.shutdown(wait=True)
+
+
+async def main(args):
+    utterance_cache = None
+    if args.cache_dir is not None:
+        utterance_cache = cache.UtteranceCache(args.cache_dir, int(args.cache_size * 2**20))
+    synth = await AsyncSynthesizer.load(args.monophones, rate=args.rate, max_concurrency=args.concurrency,
+                                        utterance_cache=utterance_cache)
+    try:
+        if not os.path.isdir(args.outdir):
+            os.makedirs(args.outdir)
+        paths = [os.path.join(args.outdir, "%d.wav" % i) for i in range(len(args.phrases))]
+        await asyncio.gather(*[synth.synthesize_to_file(phrase, path, spell=args.spell, volume=args.volume,
+                                                        speaking_rate=args.speaking_rate)
+                               for phrase, path in zip(args.phrases, paths)])
+        for phrase, path in zip(args.phrases, paths):
+            print("%s: %s" % (path, phrase))
+    finally:
+        synth.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Synthesise several phrases concurrently with the asyncio API.')
+    parser.add_argument('phrases', nargs='+', help="Phrases to synthesise")
+    parser.add_argument('--outdir', '-o', default=".", help="Folder to write 0.wav, 1.wav, ... to")
+    parser.add_argument('--monophones', default="monophones", help="Folder or bank containing monophone wavs")
+    parser.add_argument('--concurrency', '-j', default=4, type=int, help="Number of phrases rendered at once")
+    parser.add_argument('--spell', '-s', action="store_true", default=False,
+                        help="Spell the phrases instead of pronouncing them")
+    parser.add_argument('--volume', '-v', default=None, type=float,
+                        help="A float between 0.0 and 1.0 representing the desired volume")
+    parser.add_argument('--speaking-rate', default=None, type=float,
+                        help="Speed of the speech relative to the recordings, e.g. 0.8 for slower or 1.5 for faster")
+    parser.add_argument('--rate', default=16000, type=int, help="Sample rate of the output audio")
+    parser.add_argument('--cache-dir', default=None, help="Directory to cache synthesised utterances in")
+    parser.add_argument('--cache-size', default=256, type=float, help="Size limit of the cache directory in MB")
+    parser.add_argument('--user-lexicon', default=None,
+                        help="Pronunciation file for words missing from cmudict, letter-to-sound results are added to it")
+    args = parser.parse_args()
+
+    lts.set_user_lexicon(args.user_lexicon)
+    asyncio.run(main(args))
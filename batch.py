@@ -0,0 +1,188 @@
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+import warnings
+import numpy as np
+import synthesizer
+import lexicon
+import cache
+import lts
+
+##############################################################################
+# Batch synthesis                                                            #
+# renders every line of a manifest with a pool of worker processes          #
+# manifest lines are tab separated: phrase, output path, spell, volume,     #
+# speaking rate (the last three are optional, blank lines and lines         #
+# starting # are skipped), e.g.                                              #
+#   hello world<TAB>out/hello.wav                                            #
+#   abc<TAB>out/abc.wav<TAB>spell<TAB>0.8                                    #
+##############################################################################
+TRUE_STRINGS = ("1", "true", "yes", "y", "spell", "s")
+
+# the Synth object of the current process, created before the pool forks so every
+# worker shares its phone data (with a bank the data is an mmap shared by all processes)
+_synth = None
+# the utterance cache of the current process (processes share the directory, not the object)
+_cache = None
+# whether every rendered item is checked (levels, clipping, silence and phone joins)
+_qa = False
+
+
+# function that parses a manifest into work items
+# input: lines of the manifest (iterable of string), speaking rate of items that don't give one (float or None)
+# output: list of items (dict of line, phrase, outfile, spell, volume, speaking_rate or, for bad lines, error)
+def read_manifest(lines, speaking_rate=None):
+    items = []
+    for number, line in enumerate(lines, 1):
+        line = line.rstrip("\r\n")
+        if not line.strip() or line.startswith("#"):
+            continue
+        fields = line.split("\t")
+        item = {"line": number}
+        try:
+            if len(fields) < 2 or not fields[0].strip() or not fields[1].strip():
+                raise ValueError("expected phrase<TAB>outfile[<TAB>spell[<TAB>volume[<TAB>speaking rate]]]")
+            item["phrase"] = fields[0]
+            item["outfile"] = fields[1].strip()
+            item["spell"] = len(fields) > 2 and fields[2].strip().lower() in TRUE_STRINGS
+            item["volume"] = float(fields[3]) if len(fields) > 3 and fields[3].strip() else None
+            item["speaking_rate"] = float(fields[4]) if len(fields) > 4 and fields[4].strip() else speaking_rate
+        except ValueError as e:
+            item["error"] = str(e)
+        items.append(item)
+    return items
+
+
+# function that loads the voice in a worker, unless it was inherited from the parent process
+def init_worker(wav_folder, rate, cache_dir=None, cache_bytes=None, memo_bytes=synthesizer.WORD_MEMO_BYTES, qa=False):
+    global _synth, _cache, _qa
+    _qa = qa
+    if _synth is None:
+        _synth = synthesizer.Synth(wav_folder=wav_folder, rate=rate, memo_bytes=memo_bytes)
+    if cache_dir is not None:
+        _cache = cache.UtteranceCache(cache_dir, cache_bytes)
+
+
+# function that checks a rendered item: the level summary of the audio and the worst of its phone joins
+# input: item (dict), rendered audio (Audio object), output: dict (see Audio.summary, plus the join stats)
+def check_item(item, out):
+    positions = _synth.join_positions(synthesizer.get_phone_seq(item["phrase"], item["spell"]))
+    if item.get("speaking_rate"):
+        positions = np.round(positions / item["speaking_rate"]).astype(int)
+    joins = out.join_summary(positions)
+    qa = out.summary()
+    qa["joins"] = len(joins["position"])
+    qa["max_join_jump"] = float(joins["jump"].max()) if qa["joins"] else 0.0
+    qa["max_join_distance"] = float(joins["spectral_distance"].max()) if qa["joins"] else 0.0
+    qa["mean_join_distance"] = float(joins["spectral_distance"].mean()) if qa["joins"] else 0.0
+    return qa
+
+
+# function that renders one item of the manifest, failures are reported rather than raised
+# so one bad item does not stop the batch
+# input: item (dict), output: result (dict of line, outfile, ok, error, warnings, qa, seconds, audio_seconds)
+def render_item(item):
+    result = {"line": item["line"], "outfile": item.get("outfile"), "ok": False}
+    start = time.time()
+    if "error" in item:
+        result["error"] = item["error"]
+        return result
+    try:
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always", lts.UnknownWordWarning)
+            out = synthesizer.synthesize(_synth, item["phrase"], spell=item["spell"], volume=item["volume"], cache=_cache,
+                                     speaking_rate=item.get("speaking_rate"))
+            if _qa:
+                result["qa"] = check_item(item, out)
+        # words that were pronounced by the letter-to-sound rules (once each, the checks look them up again)
+        messages = [str(w.message) for w in caught if issubclass(w.category, lts.UnknownWordWarning)]
+        result["warnings"] = sorted(set(messages), key=messages.index)
+        out.save(item["outfile"])
+        result["ok"] = True
+        result["audio_seconds"] = out.samples_to_time(len(out))
+    except Exception as e:
+        result["error"] = "%s: %s" % (type(e).__name__, e)
+    result["seconds"] = time.time() - start
+    return result
+
+
+# function that renders a whole manifest in parallel
+# input: items from read_manifest (list of dict), path of monophone folder or bank (string),
+#        synthesis rate (int), number of worker processes (int, None for one per core),
+#        utterance cache directory (string or None) and its size limit in bytes (int),
+#        size of each worker's word memo in bytes (int), whether to check every item (bool, see check_item)
+# output: report (dict of results, sorted by manifest line, and throughput stats)
+def run_batch(items, wav_folder, rate=16000, processes=None, cache_dir=None, cache_bytes=256 * 2**20,
+              memo_bytes=synthesizer.WORD_MEMO_BYTES, qa=False):
+    global _synth
+    start = time.time()
+    # load everything before forking so the workers share it instead of loading their own copy
+    _synth = synthesizer.Synth(wav_folder=wav_folder, rate=rate, memo_bytes=memo_bytes)
+    lexicon.get_lexicon()
+    pool = multiprocessing.Pool(processes, initializer=init_worker,
+                                initargs=(wav_folder, rate, cache_dir, cache_bytes, memo_bytes, qa))
+    try:
+        chunksize = max(1, len(items) // (4 * (processes or multiprocessing.cpu_count())))
+        results = sorted(pool.imap_unordered(render_item, items, chunksize), key=lambda r: r["line"])
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - start
+    ok = [r for r in results if r["ok"]]
+    audio_seconds = sum(r["audio_seconds"] for r in ok)
+    return {"results": results,
+            "items": len(results),
+            "succeeded": len(ok),
+            "failed": len(results) - len(ok),
+            "seconds": elapsed,
+            "items_per_second": len(results) / elapsed if elapsed else 0.0,
+            "audio_seconds": audio_seconds,
+            "realtime_factor": elapsed / audio_seconds if audio_seconds else None}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Synthesise every phrase of a manifest in parallel.')
+    parser.add_argument('manifest', help="Tab separated manifest: phrase, outfile[, spell[, volume[, speaking rate]]] ('-' for stdin)")
+    parser.add_argument('--monophones', default="monophones", help="Folder or bank containing monophone wavs")
+    parser.add_argument('--processes', '-j', default=None, type=int, help="Number of worker processes (default: one per core)")
+    parser.add_argument('--report', '-r', default=None, help="Write the per item report to this json file")
+    parser.add_argument('--qa', action="store_true", default=False,
+                        help="Check every item (levels, clipping, silence and phone joins) and add the results to the report")
+    parser.add_argument('--cache-dir', default=None, help="Directory to cache synthesised utterances in")
+    parser.add_argument('--cache-size', default=256, type=float, help="Size limit of the cache directory in MB")
+    parser.add_argument('--rate', default=16000, type=int, help="Sample rate of the output audio")
+    parser.add_argument('--speaking-rate', default=None, type=float,
+                        help="Speaking rate of items that don't give one, e.g. 0.8 for slower or 1.5 for faster")
+    parser.add_argument('--user-lexicon', default=None,
+                        help="Pronunciation file for words missing from cmudict, letter-to-sound results are added to it")
+    parser.add_argument('--memo-size', default=synthesizer.WORD_MEMO_BYTES / 2.0**20, type=float,
+                        help="Memory for rendered words reused across items, per worker, in MB (0 to disable)")
+    args = parser.parse_args()
+
+    if args.manifest == "-":
+        items = read_manifest(sys.stdin, args.speaking_rate)
+    else:
+        with open(args.manifest) as f:
+            items = read_manifest(f, args.speaking_rate)
+    # set before the workers fork, so they all read and add to the same file
+    lts.set_user_lexicon(args.user_lexicon)
+    report = run_batch(items, args.monophones, rate=args.rate, processes=args.processes,
+                       cache_dir=args.cache_dir, cache_bytes=int(args.cache_size * 2**20),
+                       memo_bytes=int(args.memo_size * 2**20), qa=args.qa)
+    if args.report is not None:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+    for result in report["results"]:
+        for warning in result.get("warnings", []):
+            sys.stderr.write("line %d (%s): %s\n" % (result["line"], result["outfile"], warning))
+        if not result["ok"]:
+            sys.stderr.write("line %d (%s): %s\n" % (result["line"], result["outfile"], result["error"]))
+    print("%d/%d items succeeded in %.2fs (%.1f items/s, %.1fs of audio)" % (
+        report["succeeded"], report["items"], report["seconds"], report["items_per_second"], report["audio_seconds"]))
+    if args.qa:
+        checked = [result for result in report["results"] if "qa" in result]
+        print("%d/%d checked items have clipped samples" % (
+            sum(1 for result in checked if result["qa"]["clipped"]), len(checked)))
+    sys.exit(1 if report["failed"] else 0)
@@ -0,0 +1,586 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+import numpy as np
+import SimpleAudio as SA
+
+##########################################################################
+# Benchmarks for the synthesis pipeline                                  #
+# run with: python benchmark.py <benchmark name>                         #
+# every benchmark uses generated fixtures, so no audio device is needed  #
+# --json writes the results to a file, and --baseline compares the       #
+# pipeline stages with the results of an earlier run, e.g.               #
+#   python benchmark.py pipeline --json baseline.json                    #
+#   python benchmark.py pipeline --baseline baseline.json                #
+##########################################################################
+# a stage regresses when it takes longer than this times its baseline time...
+REGRESSION_THRESHOLD = 1.25
+# ...and at least this many seconds longer (shorter timings are mostly noise)
+REGRESSION_MIN_SECONDS = 0.002
+# modules that importing the synthesizer must not load: the audio device, plotting and nltk
+# are only needed by runs that play, record, plot or compile the lexicon
+HEAVY_MODULES = ("pyaudio", "pylab", "matplotlib", "nltk")
+
+
+# function that writes a 16 bit mono wav of white noise
+# input: path of the file (string), number of samples (int), output: none
+def make_wav(path, n_samples, rate=16000):
+    data = np.random.RandomState(0).randint(-2**14, 2**14, n_samples).astype(np.int16)
+    wf = wave.open(path, 'wb')
+    wf.setnchannels(1)
+    wf.setsampwidth(2)
+    wf.setframerate(rate)
+    wf.writeframes(data.tobytes())
+    wf.close()
+
+
+# function that times a call, taking the best of several runs to reduce noise
+# input: function with no arguments, number of runs (int), output: time in seconds (float)
+def time_call(fn, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        fn()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+# function that estimates how run time grows with input size by fitting
+# time = c * n^k on a log-log scale, k is close to 1 for linear algorithms
+# input: list of sizes, list of times, output: k (float)
+def scaling_exponent(sizes, times):
+    return np.polyfit(np.log(sizes), np.log(np.maximum(times, 1e-9)), 1)[0]
+
+
+# the chunk-by-chunk loader Audio.load used to implement, kept for comparison
+def legacy_load(path, chunk=SA.CHUNK):
+    wf = wave.open(path, "rb")
+    data = np.array([], dtype=np.int16)
+    raw = wf.readframes(chunk)
+    while len(raw) > 0:
+        data = np.append(data, np.frombuffer(raw, dtype=np.int16))
+        raw = wf.readframes(chunk)
+    wf.close()
+    return data
+
+
+# benchmark for Audio.load: loads files of increasing length with every loader
+def bench_load(max_power=22, legacy_max_power=18):
+    tmp = tempfile.mkdtemp()
+    try:
+        sizes = [2**p for p in range(12, max_power + 1, 2)]
+        results = {"bulk": [], "mmap": [], "legacy": []}
+        print("%10s %14s %14s %14s" % ("samples", "bulk ns/smp", "mmap ns/smp", "legacy ns/smp"))
+        for n in sizes:
+            path = os.path.join(tmp, "%d.wav" % n)
+            make_wav(path, n)
+            a = SA.Audio()
+            bulk = time_call(lambda: a.load(path, mmap=False))
+            # touch every sample so the mapped pages are actually read
+            mapped = time_call(lambda: (a.load(path, mmap=True), a.data.sum()))
+            results["bulk"].append(bulk)
+            results["mmap"].append(mapped)
+            if n <= 2**legacy_max_power:
+                legacy = time_call(lambda: legacy_load(path), repeat=1)
+                results["legacy"].append(legacy)
+                legacy_str = "%14.1f" % (legacy * 1e9 / n)
+            else:
+                legacy_str = "%14s" % "-"
+            print("%10d %14.1f %14.1f %s" % (n, bulk * 1e9 / n, mapped * 1e9 / n, legacy_str))
+        for name, times in sorted(results.items()):
+            print("%s: time grows as n^%.2f" % (name, scaling_exponent(sizes[:len(times)], times)))
+        return results
+    finally:
+        shutil.rmtree(tmp)
+
+
+# the sample-by-sample loops the Audio methods used to implement, kept for comparison
+def legacy_rescale(data, val):
+    peak = 0
+    for i in range(0, data.shape[0] - 1):
+        if abs(data[i]) > peak:
+            peak = abs(data[i])
+    array = np.zeros(data.shape[0], np.float64)
+    array += data
+    array *= val * SA.MAX_AMP / float(peak)
+    return array.astype(np.int16)
+
+
+def legacy_tone(frequency, length, amplitude, rate):
+    s = np.zeros(length, np.int16)
+    for i in range(0, length):
+        s[i] = amplitude * SA.MAX_AMP * math.sin(frequency * i * 2 * math.pi / rate)
+    return s
+
+
+def legacy_noise(length, amplitude):
+    s = np.zeros(length, np.int16)
+    for i in range(0, length):
+        s[i] = amplitude * SA.MAX_AMP * random.random()
+    return s
+
+
+def legacy_reverse(data):
+    length = data.shape[0]
+    array = np.zeros(length, dtype=np.int16)
+    for i in range(0, length):
+        array[i] = data[length - 1 - i]
+    return array
+
+
+# benchmark for the Audio DSP methods: one minute of 16kHz audio with the old loops and the new kernels
+def bench_dsp(seconds=60, rate=16000):
+    n = seconds * rate
+    a = SA.Audio(rate=rate)
+    a.create_noise(n, 0.5, seed=0)
+    noise = a.data
+    cases = [("rescale", lambda: legacy_rescale(noise, 0.8), lambda: (setattr(a, "data", noise), a.rescale(0.8))),
+             ("create_tone", lambda: legacy_tone(440.0, n, 0.8, rate), lambda: a.create_tone(440.0, n, 0.8)),
+             ("create_noise", lambda: legacy_noise(n, 0.8), lambda: a.create_noise(n, 0.8, seed=1)),
+             ("reverse", lambda: legacy_reverse(noise), lambda: (setattr(a, "data", noise), a.reverse())),
+             ("add_echo", None, lambda: (setattr(a, "data", noise), a.add_echo(3, rate // 4)))]
+    results = {}
+    print("%d samples (%ds at %dHz)" % (n, seconds, rate))
+    print("%14s %12s %12s %10s" % ("method", "old ms", "new ms", "speedup"))
+    for name, old, new in cases:
+        new_time = time_call(new)
+        old_time = time_call(old, repeat=1) if old is not None else None
+        results[name] = {"old": old_time, "new": new_time}
+        if old_time is None:
+            print("%14s %12s %12.2f %10s" % (name, "-", new_time * 1000, "-"))
+        else:
+            print("%14s %12.1f %12.2f %9.0fx" % (name, old_time * 1000, new_time * 1000, old_time / new_time))
+    return results
+
+
+# function that loads a wav file
+# input: path (string), output: Audio object
+def load_wav(path):
+    audio = SA.Audio()
+    audio.load(path)
+    return audio
+
+
+# function that writes a monophone folder with a short noise wav for every phone of the lexicon
+# input: path of the folder (string), phone length in samples (int)
+def make_monophones(folder, n_samples=1600):
+    import lexicon
+    for phone in lexicon.get_lexicon().phones:
+        make_wav(os.path.join(folder, phone + ".wav"), n_samples)
+
+
+# benchmark for the word memo: IVR style phrases that share a small vocabulary,
+# rendered with and without the memo
+def bench_memo(n_phrases=2000):
+    import synthesizer
+    rng = random.Random(0)
+    menu = ["press", "one", "two", "three", "for", "sales", "support", "billing", "to", "repeat", "this", "menu", "."]
+    phrases = [" ".join(rng.choice(menu) for i in range(12)) + " %d" % rng.randint(0, 999) for j in range(n_phrases)]
+    folder = tempfile.mkdtemp()
+    try:
+        make_monophones(folder)
+        results = {}
+        print("%d phrases of 13+ words from a %d word vocabulary" % (n_phrases, len(menu)))
+        print("%10s %12s %14s" % ("memo", "phrases/s", "hit ratio"))
+        for name, memo_bytes in [("off", 0), ("on", synthesizer.WORD_MEMO_BYTES)]:
+            synth = synthesizer.Synth(wav_folder=folder, rate=16000, memo_bytes=memo_bytes)
+            synthesizer.synthesize(synth, phrases[0])  # warm up the lexicon
+            elapsed = time_call(lambda: [synthesizer.synthesize(synth, phrase) for phrase in phrases], repeat=1)
+            stats = synth.word_memo.stats() if synth.word_memo is not None else None
+            results[name] = {"seconds": elapsed, "memo": stats}
+            print("%10s %12.0f %14s" % (name, n_phrases / elapsed,
+                                         "-" if stats is None else "%.3f" % stats["hit_ratio"]))
+        return results
+    finally:
+        shutil.rmtree(folder)
+
+
+# benchmark for the polyphase resampler: one minute of 16kHz audio converted to the common output rates
+def bench_resample(seconds=60, rate=16000):
+    a = SA.Audio(rate=rate)
+    a.create_noise(seconds * rate, 0.5, seed=0)
+    print("%d samples (%ds at %dHz)" % (len(a.data), seconds, rate))
+    print("%10s %12s %14s" % ("rate", "ms", "x realtime"))
+    results = {}
+    for out_rate in [8000, 22050, 44100, 48000]:
+        elapsed = time_call(lambda: SA.resample_poly(a.data, out_rate, rate))
+        results[out_rate] = elapsed
+        print("%10d %12.1f %14.0f" % (out_rate, elapsed * 1000, seconds / elapsed))
+    return results
+
+
+# benchmark for the float32 signal path: a chain of volume, echo and mixing on one minute of audio,
+# with every step converting int16 -> float64 -> int16, and in float32 with one conversion at each end
+def bench_float(seconds=60, rate=16000):
+    other = SA.Audio(rate=rate)
+    other.create_noise(seconds * rate, 0.3, seed=1)
+    source = SA.Audio(rate=rate)
+    source.create_noise(seconds * rate, 0.5, seed=0)
+
+    def chain(float_path):
+        a = SA.Audio(rate=rate)
+        a.data = source.data
+        if float_path:
+            a.to_format(SA.paFloat32)
+        a.rescale(0.8)
+        a.add_echo(3, rate // 4)
+        a.add(other)
+        a.rescale(0.9)
+        if float_path:
+            a.to_format(SA.paInt16)
+        return a
+
+    print("%d samples (%ds at %dHz)" % (len(source.data), seconds, rate))
+    print("%10s %12s" % ("path", "ms"))
+    results = {}
+    for name, float_path in [("int16", False), ("float32", True)]:
+        results[name] = time_call(lambda: chain(float_path))
+        print("%10s %12.1f" % (name, results[name] * 1000))
+    return results
+
+
+# input device that delivers a generated signal through the stream callback as fast as it is consumed,
+# the whole recording happens inside open(); the signal cycles through a few different chunks,
+# so expected() can tell whether every sample was recorded, in order
+class FakeInputDevice(object):
+    def __init__(self, n_chunks=7):
+        self.n_chunks = n_chunks
+        self.signal = None
+
+    def open(self, format, channels, rate, input, frames_per_buffer, stream_callback):
+        self.signal = np.random.RandomState(0).randint(-2**14, 2**14, self.n_chunks * frames_per_buffer * channels).astype(np.int16)
+        chunks = [chunk.tobytes() for chunk in np.split(self.signal, self.n_chunks)]
+        i = 0
+        while stream_callback(chunks[i % self.n_chunks], frames_per_buffer, {}, 0)[1] != SA.paComplete:
+            i += 1
+        return self
+
+    # the first n samples the device has delivered
+    def expected(self, n):
+        return np.resize(self.signal, n)
+
+    def stop_stream(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# the chunk by chunk np.append that Audio.record used before the preallocated recorder
+def legacy_record(n_chunks, chunk=SA.CHUNK):
+    data = np.array([], dtype=np.int16)
+    raw = np.random.RandomState(0).randint(-2**14, 2**14, chunk).astype(np.int16).tobytes()
+    for i in range(n_chunks):
+        data = np.append(data, np.frombuffer(raw, dtype=np.int16))
+    return data
+
+
+# benchmark for Audio.record: microseconds per chunk for takes of increasing length,
+# appending every chunk, into a preallocated buffer and streamed to a WAV file
+def bench_record(seconds=(10, 60, 300), rate=16000, legacy_max_seconds=60):
+    tmp = tempfile.mkdtemp()
+    try:
+        print("%10s %14s %14s %14s" % ("seconds", "append us", "buffer us", "file us"))
+        results = {}
+        for duration in seconds:
+            n_chunks = duration * rate // SA.CHUNK
+            a = SA.Audio(rate=rate)
+            legacy = time_call(lambda: legacy_record(n_chunks), repeat=1) if duration <= legacy_max_seconds else None
+            device = FakeInputDevice()
+            buffered = time_call(lambda: a.record_async(duration, device).wait(), repeat=1)
+            assert np.array_equal(a.data, device.expected(duration * rate)), "recorded samples differ"
+            path = os.path.join(tmp, "take.wav")
+            recordings = []
+
+            def record_to_file():
+                recordings.append(a.record_async(duration, FakeInputDevice(), path))
+                recordings[-1].wait()
+            streamed = time_call(record_to_file, repeat=1)
+            # the device delivers faster than real time, so the writer may fall behind and drop samples,
+            # but every sample is either in the file or counted as dropped
+            assert len(a.data) == duration * rate - recordings[-1].dropped_frames, "samples lost without being counted"
+            results[duration] = {"append": legacy, "buffer": buffered, "file": streamed}
+            print("%10d %14s %14.2f %14.2f" % (duration, "-" if legacy is None else "%.2f" % (legacy * 1e6 / n_chunks),
+                                             buffered * 1e6 / n_chunks, streamed * 1e6 / n_chunks))
+        # with a ring buffer that holds the whole take nothing can be dropped, so the file must hold every sample
+        duration = seconds[0]
+        device = FakeInputDevice()
+        recording = a.record_async(duration, device, path, buffer_chunks=duration * rate // SA.CHUNK + 1)
+        recording.wait()
+        assert recording.dropped_frames == 0
+        assert np.array_equal(a.data, device.expected(duration * rate)), "samples recorded to file differ"
+        return results
+    finally:
+        shutil.rmtree(tmp)
+
+
+# the frame by frame time stretch that Audio.time_stretch_fft used before the STFT engine
+def legacy_time_stretch(data, factor, windowsize=1024, overlap=512):
+    phase = np.zeros(windowsize)
+    amp_window = np.hanning(windowsize)
+    result = np.zeros(int(len(data) / factor + windowsize))
+    for i in np.arange(0, len(data) - (windowsize + overlap), overlap * factor, dtype=int):
+        s1 = np.fft.fft(amp_window * data[i: i + windowsize])
+        s2 = np.fft.fft(amp_window * data[i + overlap: i + windowsize + overlap])
+        phase = (phase + np.angle(s2 / s1)) % 2 * np.pi
+        i2 = int(i / factor)
+        result[i2: i2 + windowsize] += amp_window * np.real(np.fft.ifft(np.abs(s2) * np.exp(1j * phase)))
+    return ((2 ** (16 - 4)) * result / result.max()).astype(np.int16)
+
+
+# benchmark for the time stretch: real time factor (processing time / audio duration, lower is faster)
+# of speaking rate changes on long audio, with the old loop and the STFT engine
+def bench_stretch(seconds=(60, 600), rate=16000):
+    print("%10s %8s %12s %12s" % ("seconds", "factor", "old RTF", "new RTF"))
+    results = {}
+    for duration in seconds:
+        a = SA.Audio(rate=rate)
+        a.create_noise(duration * rate, 0.5, seed=0)
+        noise = a.data
+        for factor in [0.8, 1.5]:
+            new_time = time_call(lambda: (setattr(a, "data", noise), a.time_stretch_fft(factor)), repeat=1)
+            # the old loop is only timed on the shorter audio, it scales linearly
+            old_time = time_call(lambda: legacy_time_stretch(noise, factor), repeat=1) if duration <= 60 else None
+            results[(duration, factor)] = {"old": old_time, "new": new_time}
+            print("%10d %8.1f %12s %12.4f" % (duration, factor, "-" if old_time is None else "%.4f" % (old_time / duration),
+                                             new_time / duration))
+    return results
+
+
+# the frame by frame analysis the batched API replaces: one FFT and one rms per window, from python
+def legacy_analysis(data, frame_length=1024, hop=256):
+    spectra, levels = [], []
+    for start in range(0, len(data) - frame_length + 1, hop):
+        window = data[start: start + frame_length]
+        spectrum = abs(np.fft.fft(window))[:frame_length // 2 + 1]
+        spectra.append(spectrum * np.hanning(len(spectrum)))
+        levels.append(np.sqrt(np.mean(window.astype(np.float64) ** 2)))
+    return np.array(spectra), np.array(levels)
+
+
+# benchmark for the analysis API: spectrogram and level summary of a corpus of short utterances,
+# window by window and batched
+def bench_analysis(n_files=200, seconds=3, rate=16000):
+    corpus = []
+    for seed in range(n_files):
+        a = SA.Audio(rate=rate)
+        a.create_noise(seconds * rate, 0.5, seed=seed)
+        corpus.append(a)
+    print("%d files of %ds at %dHz" % (n_files, seconds, rate))
+    print("%10s %12s %12s" % ("", "s", "files/s"))
+    results = {}
+    for name, analyse in [("old", lambda a: legacy_analysis(a.data)),
+                          ("new", lambda a: (a.spectrogram(), a.summary()))]:
+        elapsed = time_call(lambda: [analyse(a) for a in corpus], repeat=1)
+        results[name] = elapsed
+        print("%10s %12.2f %12.0f" % (name, elapsed, n_files / elapsed))
+    return results
+
+
+# function that generates a text corpus of words, numbers, dates and punctuation
+# input: number of tokens (int), fraction of the tokens that are numbers and dates (float), output: text (string)
+def make_corpus(n_tokens, seed=0, numeric=0.2):
+    rng = random.Random(seed)
+    words = ["the", "meeting", "is", "on", "at", "pay", "pounds", "and", "room", "call", "me", "before", "total"]
+    tokens = []
+    for i in range(n_tokens):
+        kind = rng.random()
+        if kind < numeric * 0.5:
+            tokens.append(str(rng.randint(0, 10**rng.randint(1, 7))))
+        elif kind < numeric * 0.75:
+            tokens.append("%d.%02d" % (rng.randint(0, 999), rng.randint(0, 99)))
+        elif kind < numeric:
+            tokens.append("%d/%d/%d" % (rng.randint(1, 28), rng.randint(1, 12), rng.randint(1950, 2030)))
+        elif kind < numeric + 0.1:
+            tokens.append(rng.choice(",.?!"))
+        else:
+            tokens.append(rng.choice(words))
+    return " ".join(tokens)
+
+
+# benchmark for the text normalizer: tokens per second over a generated corpus,
+# with the number/date memo empty (every token expanded) and filled
+def bench_normalize(n_tokens=500000):
+    import synthesizer
+    text = make_corpus(n_tokens)
+    print("%d tokens (%.1f MB of text)" % (n_tokens, len(text) / 2.0**20))
+    print("%10s %14s %10s" % ("memo", "tokens/s", "MB/s"))
+    results = {}
+    for name in ["cold", "warm"]:
+        if name == "cold":
+            synthesizer._expansions.clear()
+        elapsed = time_call(lambda: synthesizer.normalize_text(text), repeat=1)
+        results[name] = elapsed
+        print("%10s %14.0f %10.2f" % (name, n_tokens / elapsed, len(text) / 2.0**20 / elapsed))
+    return results
+
+
+# function that times importing modules in a fresh interpreter
+# input: module names (list of string, empty for the bare interpreter), number of runs (int)
+# output: (seconds, the best of the runs (float), heavy modules the imports loaded (list of string))
+def import_time(modules, repeat=5):
+    code = "import sys; %s; print(' '.join(m for m in %r if m in sys.modules))" % (
+        "; ".join("import " + module for module in modules) or "pass", HEAVY_MODULES)
+    command = [sys.executable, "-c", code]
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    seconds = time_call(lambda: subprocess.check_output(command, cwd=cwd), repeat=repeat)
+    return seconds, subprocess.check_output(command, cwd=cwd).decode("ascii").split()
+
+
+# benchmark for the start up of the command line programs: importing each module in a fresh
+# interpreter, and which of the heavy modules that loads
+def bench_import(modules=("SimpleAudio", "synthesizer", "server", "batch")):
+    print("%14s %12s  %s" % ("module", "ms", "heavy modules loaded"))
+    results = {}
+    for module in ("python",) + tuple(modules):
+        seconds, loaded = import_time([] if module == "python" else [module])
+        results[module] = {"seconds": seconds, "loaded": loaded}
+        print("%14s %12.1f  %s" % (module, seconds * 1000, " ".join(loaded) or "-"))
+    return results
+
+
+# benchmark for every stage of the synthesis pipeline on its own, and the command line end to end,
+# with a generated voice (as a monophone folder and as a bank) and generated phrases of increasing
+# length, plain words and number/date heavy
+# output: dict of stage: dict of fixture: seconds (the best of several runs)
+def bench_pipeline(sizes=(10, 100, 1000), cli_sizes=(10, 100)):
+    import synthesizer
+    import lexicon
+    import phonebank
+    tmp = tempfile.mkdtemp()
+    try:
+        folder = os.path.join(tmp, "monophones")
+        os.mkdir(folder)
+        make_monophones(folder)
+        bank = os.path.join(tmp, "monophones.bank")
+        phonebank.build_bank(folder, bank)
+        corpora = [("%s/%d" % (kind, n), make_corpus(n, numeric=numeric))
+                   for kind, numeric in [("words", 0.0), ("numeric", 0.8)] for n in sizes]
+        results = {"get_wavs": {}, "lexicon": {}, "normalize": {}, "concatenate": {}, "rescale": {},
+                   "save": {}, "load": {}, "cli": {}, "import": {}}
+        # a fresh interpreter per run, so the cold start of the command line is guarded too
+        for module in ["SimpleAudio", "synthesizer"]:
+            results["import"][module] = import_time([module])[0]
+        for name, path in [("folder", folder), ("bank", bank)]:
+            results["get_wavs"][name] = time_call(lambda: synthesizer.Synth(wav_folder=path, rate=16000, memo_bytes=0))
+        # the first lookup of a process opens the compiled lexicon
+        generator = synthesizer.Word_to_phone_seq_generator("")
+        results["lexicon"]["open"] = time_call(lambda: (lexicon._lexicons.clear(),
+                                                        generator.word_tokens_to_phone_seq(["hello"])))
+        synth = synthesizer.Synth(wav_folder=bank, rate=16000, memo_bytes=0)
+        out = SA.Audio(rate=16000)
+        for name, text in corpora:
+            results["normalize"][name] = time_call(lambda: synthesizer.normalize_text(text))
+            tokens = synthesizer.normalize_text(text)
+            results["lexicon"][name] = time_call(lambda: generator.word_tokens_to_phone_seq(tokens))
+            phone_seq = generator.word_tokens_to_phone_seq(tokens)
+            results["concatenate"][name] = time_call(lambda: synth.concatenate(phone_seq))
+            data = synth.concatenate(phone_seq)
+            results["rescale"][name] = time_call(lambda: (setattr(out, "data", data), out.rescale(0.8)))
+            path = os.path.join(tmp, "out.wav")
+            results["save"][name] = time_call(lambda: out.save(path))
+            # touch every sample, so large (mapped) files are timed including the first read of the audio
+            results["load"][name] = time_call(lambda: np.asarray(load_wav(path).data).sum())
+        # a fresh interpreter per run: imports, voice and lexicon load, synthesis and save
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "synthesizer.py")
+        with open(os.devnull, "w") as devnull:
+            for n in cli_sizes:
+                command = [sys.executable, script, make_corpus(n), "--monophones", bank, "-o", os.path.join(tmp, "cli.wav")]
+                results["cli"]["words/%d" % n] = time_call(lambda: subprocess.check_call(command, stdout=devnull))
+        print("%12s %14s %12s" % ("stage", "fixture", "ms"))
+        for stage in sorted(results):
+            for name in sorted(results[stage]):
+                print("%12s %14s %12.3f" % (stage, name, results[stage][name] * 1000))
+        return results
+    finally:
+        shutil.rmtree(tmp)
+
+
+# function that turns benchmark results into something json can write (keys must be strings)
+# input: results (nested dict/list of numbers), output: results with every key a string
+def json_ready(results):
+    if isinstance(results, dict):
+        return dict(("x".join(str(k) for k in key) if isinstance(key, tuple) else str(key), json_ready(value))
+                    for key, value in results.items())
+    if isinstance(results, (list, tuple)):
+        return [json_ready(value) for value in results]
+    return results
+
+
+# function that compares the pipeline stage timings with a baseline
+# input: results of bench_pipeline and of the baseline run (dict of stage: dict of fixture: seconds),
+#        threshold ratio (float), smallest difference in seconds counted as a regression (float)
+# output: list of (stage/fixture, baseline seconds, seconds, ratio, regressed) for the timings in both
+def compare_to_baseline(results, baseline, threshold=REGRESSION_THRESHOLD, min_seconds=REGRESSION_MIN_SECONDS):
+    rows = []
+    for stage in sorted(results):
+        for name in sorted(results[stage]):
+            old = baseline.get(stage, {}).get(name)
+            new = results[stage][name]
+            if old is None or new is None:
+                continue
+            ratio = new / old if old else float("inf")
+            rows.append(("%s/%s" % (stage, name), old, new, ratio, ratio > threshold and new - old > min_seconds))
+    return rows
+
+
+BENCHMARKS = {
+    "analysis": bench_analysis,
+    "load": bench_load,
+    "dsp": bench_dsp,
+    "float": bench_float,
+    "import": bench_import,
+    "memo": bench_memo,
+    "normalize": bench_normalize,
+    "pipeline": bench_pipeline,
+    "record": bench_record,
+    "resample": bench_resample,
+    "stretch": bench_stretch,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks for the speech synthesizer.')
+    parser.add_argument('benchmarks', nargs='*', default=sorted(BENCHMARKS),
+                        help="Benchmarks to run: %s (default: all)" % ", ".join(sorted(BENCHMARKS)))
+    parser.add_argument('--json', default=None, help="Write the results to this json file")
+    parser.add_argument('--baseline', default=None,
+                        help="Compare the pipeline stages with the results in this json file (written by --json)")
+    parser.add_argument('--threshold', default=REGRESSION_THRESHOLD, type=float,
+                        help="Fail when a stage takes longer than this times its baseline time")
+    args = parser.parse_args()
+    results = {}
+    for name in args.benchmarks:
+        print("== %s ==" % name)
+        results[name] = BENCHMARKS[name]()
+    if args.json is not None:
+        report = {"benchmarks": json_ready(results),
+                  "python": platform.python_version(),
+                  "numpy": np.__version__,
+                  "platform": platform.platform(),
+                  "time": time.time()}
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+    if args.baseline is not None:
+        if "pipeline" not in results:
+            parser.error("--baseline compares the pipeline benchmark, which was not run")
+        with open(args.baseline) as f:
+            baseline = json.load(f)["benchmarks"].get("pipeline", {})
+        rows = compare_to_baseline(results["pipeline"], baseline, args.threshold)
+        print("== compared with %s ==" % args.baseline)
+        print("%28s %12s %12s %8s" % ("stage", "baseline ms", "ms", "ratio"))
+        for name, old, new, ratio, regressed in rows:
+            print("%28s %12.3f %12.3f %8.2f%s" % (name, old * 1000, new * 1000, ratio, "  REGRESSION" if regressed else ""))
+        regressions = sum(1 for row in rows if row[4])
+        print("%d of %d stages regressed (threshold %.2fx)" % (regressions, len(rows), args.threshold))
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import threading
+import wave
+import SimpleAudio as SA
+
+##############################################################################
+# Utterance cache                                                            #
+# finished utterances are stored as wav files in a local directory, named   #
+# by a hash of everything that determines the audio: the normalised phone   #
+# sequence, the spell flag, the volume and the voice's content hash.        #
+# Files are written to a temporary name and renamed into place, so several  #
+# processes can share one directory; the least recently used files are     #
+# removed when the directory grows past its size budget.                    #
+##############################################################################
+CACHE_SUFFIX = ".wav"
+# errors raised when loading a truncated or corrupt entry (e.g. one left by a crashed writer on
+# a filesystem without atomic rename); such entries are removed and treated as misses
+CORRUPT_ENTRY_ERRORS = (wave.Error, struct.error, ValueError, ZeroDivisionError)
+
+
+"""
+Utterance cache class
+object in the class looks up and stores rendered utterances in a cache directory,
+and counts hits, misses and the bytes of audio served from the cache
+"""
+class UtteranceCache(object):
+    def __init__(self, directory, max_bytes=256 * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes  # size budget of the directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0        # bytes of audio served from the cache instead of being synthesised
+        self.lock = threading.Lock()
+        self.approx_bytes = sum(size for path, size, mtime in self.entries())  # kept up to date by put()
+
+    # function that computes the cache key of an utterance
+    # input: phone sequence (list of string), spell flag (bool), volume (float or None),
+    #        content hash of the voice (string), speaking rate (float or None), output: key (hex string)
+    def key(self, phone_seq, spell, volume, voice_hash, speaking_rate=None):
+        description = [list(phone_seq), bool(spell), volume, voice_hash]
+        if speaking_rate is not None:  # keeps the keys of utterances at the recorded rate unchanged
+            description.append(speaking_rate)
+        description = json.dumps(description)
+        return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+    # function that returns the path of a cache entry
+    def path(self, key):
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    # function that looks up an utterance
+    # input: key (string), output: Audio object, or None on a miss
+    def get(self, key):
+        path = self.path(key)
+        audio = SA.Audio()
+        try:
+            audio.load(path)
+            # mark the entry as recently used
+            os.utime(path, None)
+        except (IOError, OSError):
+            # missing, or removed by another process while being read
+            with self.lock:
+                self.misses += 1
+            return None
+        except CORRUPT_ENTRY_ERRORS:
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # already removed by another process
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+            self.bytes_saved += audio.data.nbytes
+        return audio
+
+    # function that stores an utterance, then removes old entries if the cache is over budget
+    # input: key (string), Audio object
+    def put(self, key, audio):
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                audio.save(f)
+            # mkstemp creates files only their owner can read
+            os.chmod(tmp_path, 0o644)
+            os.rename(tmp_path, self.path(key))
+        except (IOError, OSError):
+            # e.g. the disk is full, or renaming over an entry another process
+            # has just written is not allowed (Windows); the cache is best effort
+            os.remove(tmp_path)
+            return
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        with self.lock:
+            self.approx_bytes += audio.data.nbytes
+            over_budget = self.approx_bytes > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    # function that lists the entries of the cache directory
+    # output: list of (path, size, last use time)
+    def entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(CACHE_SUFFIX):
+                path = os.path.join(self.directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    # function that removes the least recently used entries until the cache fits its budget
+    def evict(self):
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total = sum(size for path, size, mtime in entries)
+        for path, size, mtime in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # already removed by another process
+            total -= size
+        with self.lock:
+            self.approx_bytes = total
+
+    # function that reports the cache statistics
+    # output: dict
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "hit_ratio": float(self.hits) / lookups if lookups else 0.0,
+                    "bytes_saved": self.bytes_saved,
+                    "bytes": self.approx_bytes}
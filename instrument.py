@@ -0,0 +1,139 @@
+import functools
+import json
+import sys
+import threading
+import time
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+##############################################################################
+# Instrumentation                                                            #
+# wall time and call counts of the pipeline stages (imports, voice and       #
+# lexicon loading, normalisation, lookup, concatenation, rescale, save,      #
+# play ...) and the memory held by the phone data and the lexicon.           #
+# Everything is off until enable() is called: a disabled stage costs one     #
+# flag check. The counters are per process; report() returns them, so a     #
+# long running host can export them (e.g. server.py's /stats), and          #
+# synthesizer.py --profile writes them as json at the end of a run.          #
+##############################################################################
+# the most precise wall clock available (python 2 has no perf_counter)
+timer = getattr(time, "perf_counter", time.time)
+
+_enabled = False
+_stages = {}  # key: stage name, value: [calls, seconds]
+_memory = {}  # key: name, value: bytes
+_lock = threading.Lock()
+
+
+# function that turns the instrumentation on or off, the counters are kept either way
+# input: whether to record (bool)
+def enable(on=True):
+    global _enabled
+    _enabled = bool(on)
+
+
+def is_enabled():
+    return _enabled
+
+
+# function that clears the counters
+def reset():
+    with _lock:
+        _stages.clear()
+        _memory.clear()
+
+
+# function that adds one call of a stage, whether or not the instrumentation is on
+# (for stages timed before it could be turned on, e.g. the imports)
+# input: stage name (string), time taken in seconds (float)
+def record(name, seconds):
+    with _lock:
+        entry = _stages.get(name)
+        if entry is None:
+            entry = _stages[name] = [0, 0.0]
+        entry[0] += 1
+        entry[1] += seconds
+
+
+"""
+Stage class
+object in the class is a context manager that records the time spent in its block under a stage name,
+when the instrumentation is on
+"""
+class Stage(object):
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if _enabled:
+            self.start = timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.start is not None:
+            record(self.name, timer() - self.start)
+            self.start = None
+
+
+# function that makes a decorator recording every call of a function under a stage name,
+# when the instrumentation is on
+# input: stage name (string), output: decorator
+def timed(name):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            start = timer()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(name, timer() - start)
+        return wrapper
+    return decorator
+
+
+# function that records the memory held by something (e.g. the phone data), when the instrumentation is on
+# input: name (string), size in bytes (int)
+def set_bytes(name, nbytes):
+    if _enabled:
+        with _lock:
+            _memory[name] = int(nbytes)
+
+
+# function that returns the peak resident memory of the process
+# output: bytes (int), or None where the platform doesn't report it
+def max_rss():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+# function that summarises the counters
+# output: dict of enabled (bool), stages (dict of stage name: calls, seconds, mean_ms),
+#         memory (dict of name: bytes, and max_rss, the peak resident memory of the process)
+def report():
+    with _lock:
+        stages = dict((name, {"calls": calls, "seconds": seconds, "mean_ms": seconds * 1000 / calls})
+                      for name, (calls, seconds) in _stages.items())
+        memory = dict(_memory)
+    memory["max_rss"] = max_rss()
+    return {"enabled": _enabled, "stages": stages, "memory": memory}
+
+
+# function that writes the report as json
+# input: path of the file to write, or '-' for stderr (string)
+def write_report(path):
+    text = json.dumps(report(), indent=1, sort_keys=True)
+    if path == "-":
+        sys.stderr.write(text + "\n")
+    else:
+        with open(path, "w") as f:
+            f.write(text + "\n")
@@ -0,0 +1,250 @@
+import argparse
+import json
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+import numpy as np
+import instrument
+
+####################################################################################
+# Compiled pronunciation lexicon                                                   #
+# cmudict is compiled once into a compact file that is opened with a single mmap: #
+#   magic (8 bytes) | header length (uint32) | json header | arrays               #
+# the json header holds the phone table and the byte offset of each array:       #
+#   key_offsets  uint32 (n_keys + 1)  - start of each word in key_blob            #
+#   key_blob     bytes                - utf-8 words, lower case, sorted           #
+#   pron_starts  uint32 (n_keys + 1)  - first pronunciation of each word          #
+#   pron_offsets uint32 (n_prons + 1) - start of each pronunciation in phone_ids  #
+#   phone_ids    uint8                - index of each phone in the phone table    #
+# pronunciations are stored lower case with the stress stripped, i.e. as the     #
+# phone names used by Synth.phones                                                 #
+####################################################################################
+LEXICON_MAGIC = b'SPLEX01\0'
+# arrays start on a multiple of this many bytes
+LEXICON_ALIGN = 8
+DEFAULT_LEXICON_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cmudict.lex")
+# phones every voice has that are not in the lexicon: the short and long pause used for punctuation,
+# they get the ids following the lexicon's phones in the phone table shared with Synth
+PAUSE_PHONES = ["sp", "lp"]
+
+stress_pattern = re.compile(r"\d")
+
+
+# function that converts a word into the bytes it is stored under
+# input: word (string), output: key (bytes)
+def to_key(word):
+    if not isinstance(word, bytes):
+        word = word.encode('utf-8')
+    return word.lower()
+
+
+# function that converts a cmudict pronunciation into Synth phone names
+# input: pronunciation (list of string), output: lower case phones without stress (list of string)
+def normalise_pronunciation(pron):
+    return [stress_pattern.sub("", phone).lower() for phone in pron]
+
+
+# function that reads the pronunciations of cmudict through nltk
+# output: iterator of (word, pronunciation) pairs, variants of a word in cmudict order
+def nltk_cmudict_entries():
+    import nltk
+    return nltk.corpus.cmudict.entries()
+
+
+# function that reads a dictionary file in cmudict format, either nltk's "WORD 1 PH ON ES"
+# or the plain "word PH ON ES" with "word(2)" marking variants; lines starting with ;;; are comments
+# input: path (string), output: iterator of (word, pronunciation) pairs
+def read_cmudict_file(path):
+    with open(path, 'rb') as f:
+        for line in f:
+            line = line.decode('latin-1').split('#')[0].strip()
+            if not line or line.startswith(';;;'):
+                continue
+            fields = line.split()
+            word = re.sub(r"\(\d+\)$", "", fields[0])
+            pron = fields[2:] if len(fields) > 2 and fields[1].isdigit() else fields[1:]
+            yield word, pron
+
+
+# function that compiles pronunciation entries into a lexicon file
+# input: iterable of (word, pronunciation) pairs, path of the lexicon to write (string)
+# output: number of words written (int)
+def compile_lexicon(entries, path):
+    prons = {}
+    for word, pron in entries:
+        prons.setdefault(to_key(word), []).append(normalise_pronunciation(pron))
+    phones = sorted(set(phone for variants in prons.values() for pron in variants for phone in pron))
+    if len(phones) > 256:
+        raise ValueError("too many distinct phones (%d) for uint8 phone ids" % len(phones))
+    phone_ids = dict((phone, i) for i, phone in enumerate(phones))
+
+    keys = sorted(prons)
+    key_offsets = np.zeros(len(keys) + 1, np.uint32)
+    key_offsets[1:] = np.cumsum([len(key) for key in keys])
+    variants = [pron for key in keys for pron in prons[key]]
+    pron_starts = np.zeros(len(keys) + 1, np.uint32)
+    pron_starts[1:] = np.cumsum([len(prons[key]) for key in keys])
+    pron_offsets = np.zeros(len(variants) + 1, np.uint32)
+    pron_offsets[1:] = np.cumsum([len(pron) for pron in variants])
+    ids = np.array([phone_ids[phone] for pron in variants for phone in pron], np.uint8)
+    arrays = [("key_offsets", key_offsets.astype('<u4').tobytes()),
+              ("key_blob", b"".join(keys)),
+              ("pron_starts", pron_starts.astype('<u4').tobytes()),
+              ("pron_offsets", pron_offsets.astype('<u4').tobytes()),
+              ("phone_ids", ids.tobytes())]
+
+    # lay the arrays out after the header, each one aligned
+    # (the header size depends on the offsets, so grow it until the layout is stable)
+    header = {"version": 1, "phones": phones, "n_keys": len(keys), "n_prons": len(variants)}
+    data_start = 0
+    while True:
+        position = data_start
+        for name, raw in arrays:
+            position += -position % LEXICON_ALIGN
+            header[name] = [position, len(raw)]
+            position += len(raw)
+        raw_header = json.dumps(header, sort_keys=True).encode('utf-8')
+        header_end = len(LEXICON_MAGIC) + 4 + len(raw_header)
+        if header_end <= data_start:
+            break
+        data_start = header_end + -header_end % LEXICON_ALIGN
+
+    # write to a uniquely named file next to the target and rename, so readers never see a
+    # half written lexicon and processes compiling it at the same time don't write to the same file
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(LEXICON_MAGIC)
+            f.write(struct.pack('<I', len(raw_header)))
+            f.write(raw_header)
+            for name, raw in arrays:
+                f.write(b'\0' * (header[name][0] - f.tell()))
+                f.write(raw)
+        # mkstemp creates files only their owner can read
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return len(keys)
+
+
+"""
+Lexicon class
+object in the class gives read-only, dict-like access to a compiled lexicon file
+the file is opened with a single mmap, so it loads in milliseconds and is shared by every process using it
+lookups are a binary search over the sorted words, lexicon[word] returns every pronunciation of the word
+in the same shape as nltk.corpus.cmudict.dict()[word], but with Synth phone names
+"""
+class Lexicon(object):
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(LEXICON_MAGIC)] != LEXICON_MAGIC:
+            raise ValueError("%s is not a compiled lexicon" % path)
+        header_length = struct.unpack('<I', self.mm[len(LEXICON_MAGIC):len(LEXICON_MAGIC) + 4])[0]
+        start = len(LEXICON_MAGIC) + 4
+        header = json.loads(self.mm[start:start + header_length].decode('utf-8'))
+        self.phones = [str(phone) for phone in header["phones"]]  # phone id -> phone name
+        # phone table shared with Synth: the lexicon's phones followed by the pauses
+        self.phone_table = self.phones + [phone for phone in PAUSE_PHONES if phone not in self.phones]
+        self.phone_index = dict((phone, i) for i, phone in enumerate(self.phone_table))  # phone name -> phone id
+        self.n_keys = header["n_keys"]
+        self.key_blob_offset = header["key_blob"][0]
+        self.key_offsets = self.array(header["key_offsets"], '<u4')
+        self.pron_starts = self.array(header["pron_starts"], '<u4')
+        self.pron_offsets = self.array(header["pron_offsets"], '<u4')
+        self.phone_ids = self.array(header["phone_ids"], np.uint8)
+
+    # function that views one of the arrays of the file
+    # input: [byte offset, byte length] (list), numpy dtype, output: read-only numpy array
+    def array(self, location, dtype):
+        offset, length = location
+        dtype = np.dtype(dtype)
+        return np.frombuffer(self.mm, dtype=dtype, count=length // dtype.itemsize, offset=offset)
+
+    # function that returns the ith word of the lexicon
+    # input: index (int), output: word (bytes)
+    def key(self, i):
+        start = self.key_blob_offset
+        return self.mm[start + int(self.key_offsets[i]):start + int(self.key_offsets[i + 1])]
+
+    # function that finds a word with a binary search over the sorted words
+    # input: word (string), output: index of the word, or -1 if it is not in the lexicon (int)
+    def find(self, word):
+        key = to_key(word)
+        lo, hi = 0, self.n_keys
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n_keys and self.key(lo) == key:
+            return lo
+        return -1
+
+    # function that returns the phone ids of every pronunciation of a word
+    # input: word (string), output: list of read-only uint8 arrays (raises KeyError for unknown words)
+    def pronunciation_ids(self, word):
+        i = self.find(word)
+        if i < 0:
+            raise KeyError(word)
+        offsets = self.pron_offsets
+        return [self.phone_ids[offsets[p]:offsets[p + 1]]
+                for p in range(self.pron_starts[i], self.pron_starts[i + 1])]
+
+    # function that converts phone names (e.g. from the letter-to-sound rules) into ids of the phone table
+    # input: phones (list of string), output: phone ids (numpy int array, raises KeyError for unknown phones)
+    def encode(self, phones):
+        phone_index = self.phone_index
+        return np.array([phone_index[phone] for phone in phones], np.intp)
+
+    # function that returns every pronunciation of a word
+    # input: word (string), output: list of pronunciations (list of list of string)
+    def __getitem__(self, word):
+        return [[self.phones[phone_id] for phone_id in ids] for ids in self.pronunciation_ids(word)]
+
+    def __contains__(self, word):
+        return self.find(word) >= 0
+
+    def __len__(self):
+        return self.n_keys
+
+    def get(self, word, default=None):
+        try:
+            return self[word]
+        except KeyError:
+            return default
+
+
+_lexicons = {}
+_lexicons_lock = threading.Lock()
+
+
+# function that returns the shared Lexicon object of a compiled lexicon, opening it once per process
+# if the file does not exist yet it is compiled from nltk's cmudict (a one-off cost of a few seconds)
+# input: path of the compiled lexicon (string), output: Lexicon object
+def get_lexicon(path=DEFAULT_LEXICON_PATH):
+    with _lexicons_lock:
+        if path not in _lexicons:
+            with instrument.Stage("lexicon"):
+                if not os.path.exists(path):
+                    compile_lexicon(nltk_cmudict_entries(), path)
+                _lexicons[path] = Lexicon(path)
+            instrument.set_bytes("lexicon", len(_lexicons[path].mm))
+        return _lexicons[path]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compile cmudict into a memory-mappable lexicon.')
+    parser.add_argument('outfile', nargs='?', default=DEFAULT_LEXICON_PATH, help="Path of the lexicon to write")
+    parser.add_argument('--source', default=None,
+                        help="Dictionary file in cmudict format (default: nltk's cmudict corpus)")
+    args = parser.parse_args()
+    entries = nltk_cmudict_entries() if args.source is None else read_cmudict_file(args.source)
+    print("wrote %d words to %s" % (compile_lexicon(entries, args.outfile), args.outfile))
@@ -0,0 +1,243 @@
+import argparse
+import io
+import os
+import re
+import threading
+import warnings
+
+####################################################################################
+# Letter-to-sound fallback                                                         #
+# words missing from the lexicon are pronounced with a set of context rules        #
+# instead of stopping the synthesis: at each position of the word the first rule   #
+# whose pattern matches there gives the phones for the letters it covers.          #
+# Patterns are regular expressions matched at the current position, so their      #
+# left and right context are written as lookbehind/lookahead.                      #
+# Generated pronunciations are memoized, reported with an UnknownWordWarning, and  #
+# can be appended to a user lexicon file (cmudict format: "word PH ON ES") that is #
+# consulted before the rules, so hand corrections there take effect on later runs. #
+####################################################################################
+# (pattern, phones) - the order matters, longer and more specific spellings come first
+RULES = [
+    # silent letters at the start of a word
+    (r"(?<![a-z])kn", ["n"]),
+    (r"(?<![a-z])wr", ["r"]),
+    (r"(?<![a-z])gn", ["n"]),
+    (r"(?<![a-z])ps", ["s"]),
+    (r"(?<![a-z])x", ["z"]),
+    (r"(?<![a-z])y(?=[aeiou])", ["y"]),
+    # endings
+    (r"tion(?=s?(?![a-z]))", ["sh", "ah", "n"]),
+    (r"sion(?=s?(?![a-z]))", ["zh", "ah", "n"]),
+    (r"ture(?=[sd]?(?![a-z]))", ["ch", "er"]),
+    (r"(?<=[a-z][a-z][td])ed(?![a-z])", ["ih", "d"]),
+    (r"(?<=[aeiouy][a-z][pkfsx])ed(?![a-z])", ["t"]),
+    (r"(?<=[aeiouy][a-z][cs]h)ed(?![a-z])", ["t"]),
+    (r"(?<=[aeiouy][^aeiouy])ed(?![a-z])", ["d"]),
+    (r"(?<=[a-z][sxz])es(?![a-z])", ["ih", "z"]),
+    (r"(?<=[a-z][cs]h)es(?![a-z])", ["ih", "z"]),
+    (r"(?<=[aeiouy][^aeiouys])es(?![a-z])", ["z"]),
+    (r"(?<=[aeiouy][bdgvmnlrw])s(?![a-z])", ["z"]),
+    (r"are(?![a-z])", ["eh", "r"]),
+    (r"ere(?![a-z])", ["ih", "r"]),
+    (r"ire(?![a-z])", ["ay", "er"]),
+    (r"ore(?![a-z])", ["ao", "r"]),
+    (r"ure(?![a-z])", ["uh", "r"]),
+    (r"(?<=[a-z][^aeiouy])le(?![a-z])", ["ah", "l"]),
+    (r"(?<=[a-z][a-z][^aeiouy])y(?![a-z])", ["iy"]),
+    (r"y(?![a-z])", ["ay"]),
+    (r"(?<=[a-z][a-z])e(?![a-z])", []),  # silent final e
+    (r"e(?![a-z])", ["iy"]),
+    (r"o(?![a-z])", ["ow"]),
+    (r"a(?![a-z])", ["ah"]),
+    (r"i(?![a-z])", ["iy"]),
+    # vowels made long by a silent e after a single consonant
+    (r"a(?=[^aeiouy]e[sd]?(?![a-z]))", ["ey"]),
+    (r"i(?=[^aeiouy]e[sd]?(?![a-z]))", ["ay"]),
+    (r"o(?=[^aeiouy]e[sd]?(?![a-z]))", ["ow"]),
+    (r"u(?=[^aeiouy]e[sd]?(?![a-z]))", ["uw"]),
+    (r"e(?=[^aeiouy]e[sd]?(?![a-z]))", ["iy"]),
+    # vowel spellings
+    (r"eigh", ["ey"]),
+    (r"igh", ["ay"]),
+    (r"augh", ["ao"]),
+    (r"ough", ["ao"]),
+    (r"ee|ea", ["iy"]),
+    (r"ai|ay|ei|ey", ["ey"]),
+    (r"oa", ["ow"]),
+    (r"oo(?=[kd])", ["uh"]),
+    (r"oo", ["uw"]),
+    (r"ou", ["aw"]),
+    (r"ow(?![a-z])", ["ow"]),
+    (r"ow", ["aw"]),
+    (r"oi|oy", ["oy"]),
+    (r"au|aw", ["ao"]),
+    (r"ew|ue", ["uw"]),
+    (r"ie", ["iy"]),
+    # r coloured vowels
+    (r"ar(?![aeiouyr])", ["aa", "r"]),
+    (r"or(?![aeiouyr])", ["ao", "r"]),
+    (r"(?:er|ir|ur|yr)(?![aeiouyr])", ["er"]),
+    # single vowels
+    (r"a", ["ae"]),
+    (r"e", ["eh"]),
+    (r"i|y", ["ih"]),
+    (r"o", ["aa"]),
+    (r"u", ["ah"]),
+    # consonant spellings
+    (r"tch", ["ch"]),
+    (r"dge", ["jh"]),
+    (r"ch", ["ch"]),
+    (r"sh", ["sh"]),
+    (r"ph", ["f"]),
+    (r"th", ["th"]),
+    (r"wh", ["w"]),
+    (r"gh(?![aeiouy])", []),
+    (r"gh", ["g"]),
+    (r"ng(?!e)", ["ng"]),
+    (r"nk", ["ng", "k"]),
+    (r"ck", ["k"]),
+    (r"qu", ["k", "w"]),
+    (r"x", ["k", "s"]),
+    (r"c(?=[eiy])", ["s"]),
+    (r"g(?=[eiy])", ["jh"]),
+    (r"([bcdfgklmnprstvz])\1", None),  # double consonant, pronounced as the single letter
+    (r"b", ["b"]), (r"c", ["k"]), (r"d", ["d"]), (r"f", ["f"]), (r"g", ["g"]), (r"h", ["hh"]),
+    (r"j", ["jh"]), (r"k", ["k"]), (r"l", ["l"]), (r"m", ["m"]), (r"n", ["n"]), (r"p", ["p"]),
+    (r"q", ["k"]), (r"r", ["r"]), (r"s", ["s"]), (r"t", ["t"]), (r"v", ["v"]), (r"w", ["w"]),
+    (r"z", ["z"]),
+]
+compiled_rules = [(re.compile(pattern), phones) for pattern, phones in RULES]
+letter_pattern = re.compile(r"[a-z]+")
+# pronunciation of a token the rules give no phones for (one without any of the letters a-z, e.g. "_"),
+# so every token has at least one phone: a short pause
+NO_PHONES = ["sp"]
+
+
+"""
+Unknown word warning class
+issued for every word pronounced by the letter-to-sound rules rather than found in a lexicon
+"""
+class UnknownWordWarning(UserWarning):
+    pass
+
+
+# function that pronounces a word with the letter-to-sound rules
+# characters other than the letters a-z are ignored
+# input: word (string), output: phones (list of string, Synth phone names)
+def letter_to_sound(word):
+    phones = []
+    for letters in letter_pattern.findall(word.lower()):
+        position = 0
+        while position < len(letters):
+            for pattern, rule_phones in compiled_rules:
+                match = pattern.match(letters, position)
+                if match is not None:
+                    break
+            if rule_phones is None:  # double consonant, read the first letter and skip the second
+                phones += letter_to_sound(match.group(1))
+            else:
+                phones += rule_phones
+            position = match.end()
+    # the rules can give the same phone twice across a boundary, e.g. "ck" + "k"
+    return [phone for i, phone in enumerate(phones) if i == 0 or phone != phones[i - 1]]
+
+
+"""
+User lexicon class
+object in the class holds pronunciations kept in a plain text file in cmudict format,
+one "word PH ON ES" line per pronunciation (the first one of a word is used),
+new pronunciations are appended to the file as they are added
+"""
+class UserLexicon(object):
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}  # key: word (lower case), value: phones (list of string)
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            import lexicon
+            for word, pron in lexicon.read_cmudict_file(path):
+                self.entries.setdefault(word.lower(), lexicon.normalise_pronunciation(pron))
+
+    def get(self, word, default=None):
+        return self.entries.get(word.lower(), default)
+
+    def __contains__(self, word):
+        return word.lower() in self.entries
+
+    # function that adds a pronunciation and appends it to the file
+    # input: word (string), phones (list of string)
+    def add(self, word, phones):
+        word = word.lower()
+        with self.lock:
+            if word in self.entries:
+                return
+            self.entries[word] = list(phones)
+            if isinstance(word, bytes):
+                word = word.decode("latin-1")
+            # one write per line, so processes appending to the same file do not interleave lines
+            # (latin-1, the encoding lexicon.read_cmudict_file reads)
+            with io.open(self.path, "a", encoding="latin-1", errors="replace") as f:
+                f.write(u"%s %s\n" % (word, u" ".join(phones).upper()))
+
+
+_user_lexicon = None
+_pronunciations = {}  # memoized pronunciations (key: word, value: (phones, generated by the rules))
+_fallbacks = 0        # number of words pronounced by the rules, counting repeats
+_lock = threading.Lock()
+
+
+# function that sets the user lexicon consulted (and added to) for words missing from the main lexicon
+# input: path of the user lexicon file (string), or None for no user lexicon
+def set_user_lexicon(path):
+    global _user_lexicon
+    with _lock:
+        _user_lexicon = UserLexicon(path) if path is not None else None
+        _pronunciations.clear()
+
+
+# function that pronounces a word missing from the main lexicon: from the user lexicon if it has
+# the word, otherwise with the letter-to-sound rules (with an UnknownWordWarning), memoized
+# words the rules give no phones for are read as a short pause (NO_PHONES)
+# input: word (string), output: phones (list of string, at least one)
+def pronounce(word):
+    global _fallbacks
+    key = word.lower()
+    with _lock:
+        known = _pronunciations.get(key)
+        if known is None:
+            user_lexicon = _user_lexicon
+            if user_lexicon is not None and key in user_lexicon:
+                known = (user_lexicon.get(key), False)
+            else:
+                known = (letter_to_sound(key), True)
+                if user_lexicon is not None and known[0]:
+                    user_lexicon.add(key, known[0])
+            _pronunciations[key] = known
+        if known[1]:
+            _fallbacks += 1
+    phones, generated = known
+    if not phones:
+        phones = NO_PHONES
+        if generated:
+            warnings.warn("%s is not in the lexicon and has no letters to pronounce, read as a short pause"
+                          % word, UnknownWordWarning, stacklevel=2)
+    elif generated:
+        warnings.warn("%s is not in the lexicon, pronounced as /%s/ by the letter-to-sound rules"
+                      % (word, " ".join(phones)), UnknownWordWarning, stacklevel=2)
+    return list(phones)
+
+
+# function that reports how often the letter-to-sound rules were used
+# output: dict of fallbacks (words pronounced by the rules, counting repeats) and words (distinct words)
+def stats():
+    with _lock:
+        return {"fallbacks": _fallbacks,
+                "words": sum(1 for phones, generated in _pronunciations.values() if generated)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Pronounce words with the letter-to-sound rules.')
+    parser.add_argument('words', nargs='+', help="Words to pronounce")
+    args = parser.parse_args()
+    for word in args.words:
+        print("%s %s" % (word, " ".join(letter_to_sound(word)).upper()))
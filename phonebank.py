@@ -0,0 +1,136 @@
+import argparse
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import numpy as np
+import SimpleAudio as SA
+
+#################################################################################
+# Packed monophone bank                                                         #
+# A bank file holds a whole monophone folder in one file:                       #
+#   magic (8 bytes) | header length (uint32) | json header | padding | samples  #
+# the samples of every phone are stored back to back as one int16 blob, and    #
+# the header maps each phone name to its (offset, length, rate) in that blob.  #
+#################################################################################
+BANK_MAGIC = b'SPBANK1\0'
+BANK_DTYPE = np.int16
+# the sample blob starts on a multiple of this many bytes
+BANK_ALIGN = 16
+
+
+# function that checks whether a path is a monophone bank (rather than a folder of wavs)
+# input: path (string), output: bool
+def is_bank(path):
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(BANK_MAGIC)) == BANK_MAGIC
+
+
+# function that computes the content hash of a bank from its index and samples
+# input: index (dict), samples (numpy array), output: hex digest (string)
+def content_hash(index, samples):
+    h = hashlib.sha1()
+    h.update(json.dumps(index, sort_keys=True).encode('utf-8'))
+    h.update(np.ascontiguousarray(samples, dtype=BANK_DTYPE).tobytes())
+    return h.hexdigest()
+
+
+# function that packs every wav in a monophone folder into a single bank file
+# input: path of the monophone folder (string), path of the bank to write (string)
+# output: the content hash of the written bank (string)
+def build_bank(wav_folder, bank_path):
+    index = {}
+    arrays = []
+    offset = 0
+    for file in sorted(os.listdir(wav_folder)):
+        if not file.lower().endswith('.wav'):
+            continue
+        phone = SA.Audio()
+        phone.load(os.path.join(wav_folder, file), mmap=False)
+        if phone.nptype != BANK_DTYPE or phone.chan != 1:
+            raise ValueError("%s is not a 16 bit mono wav" % file)
+        index[file.split('.')[0]] = [offset, len(phone.data), phone.rate]
+        arrays.append(phone.data)
+        offset += len(phone.data)
+    samples = np.concatenate(arrays) if arrays else np.array([], dtype=BANK_DTYPE)
+    header = {"version": 1, "dtype": "int16", "phones": index, "hash": content_hash(index, samples)}
+    raw_header = json.dumps(header, sort_keys=True).encode('utf-8')
+    data_offset = len(BANK_MAGIC) + 4 + len(raw_header)
+    padding = -data_offset % BANK_ALIGN
+    # write to a uniquely named file next to the target and rename, so readers never see a
+    # half written bank and builds running at the same time don't write to the same file
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(os.path.abspath(bank_path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(BANK_MAGIC)
+            f.write(struct.pack('<I', len(raw_header)))
+            f.write(raw_header)
+            f.write(b'\0' * padding)
+            f.write(samples.astype('<i2').tobytes())
+        # mkstemp creates files only their owner can read
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, bank_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return header["hash"]
+
+
+"""
+Phone bank class
+object in the class gives read-only access to a bank file written by build_bank
+the whole sample blob is opened with a single mmap, and each phone is served as a view into it,
+so loading costs one open regardless of the number of phones and processes share the same pages
+"""
+class PhoneBank(object):
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(BANK_MAGIC)) != BANK_MAGIC:
+                raise ValueError("%s is not a monophone bank" % path)
+            header_length = struct.unpack('<I', f.read(4))[0]
+            header = json.loads(f.read(header_length).decode('utf-8'))
+        data_offset = len(BANK_MAGIC) + 4 + header_length
+        data_offset += -data_offset % BANK_ALIGN
+        self.index = header["phones"]   # phone name -> [offset, length, rate]
+        self.content_hash = header["hash"]
+        total = max([offset + length for offset, length, rate in self.index.values()] or [0])
+        if total:
+            self.samples = np.memmap(path, dtype=BANK_DTYPE, mode='r', offset=data_offset, shape=(total,))
+        else:
+            self.samples = np.array([], dtype=BANK_DTYPE)
+
+    # function that lists the phones held in the bank
+    # output: phone names (list of string)
+    def names(self):
+        return sorted(self.index)
+
+    # function that returns the samples of a phone as a view into the bank
+    # input: phone name (string), output: samples (numpy array)
+    def __getitem__(self, name):
+        offset, length, rate = self.index[name]
+        return self.samples[offset:offset + length]
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    # function that creates an Audio object for a phone, sharing the bank's memory
+    # input: phone name (string), output: Audio object
+    def audio(self, name):
+        phone = SA.Audio(rate=self.index[name][2])
+        phone.data = self[name]
+        return phone
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Pack a folder of monophone wavs into a single bank file.')
+    parser.add_argument('monophones', help="Folder containing monophone wavs")
+    parser.add_argument('bank', help="Path of the bank file to write")
+    args = parser.parse_args()
+    print("wrote %s (hash %s)" % (args.bank, build_bank(args.monophones, args.bank)))
@@ -0,0 +1,323 @@
+import argparse
+import io
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn, UnixStreamServer
+except ImportError:  # python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn, UnixStreamServer
+import numpy as np
+import SimpleAudio as SA
+import synthesizer
+import lexicon
+import cache
+import lts
+import instrument
+
+###############################################################################
+# Synthesis server                                                            #
+# keeps one warm Synth object (and the compiled lexicon) for the life of the #
+# process and answers synthesis requests over localhost HTTP or over HTTP on #
+# a Unix socket:                                                              #
+#   POST /synthesize  {"phrase": ..., "spell": false, "volume": null,        #
+#                      "format": "wav" | "raw", "stream": false,              #
+#                      "speaking_rate": null}                                 #
+#                     -> audio bytes (sent with chunked transfer encoding    #
+#                        as it is rendered when stream is true)              #
+#   GET  /health      -> {"status": "ok", ...}                                #
+#   GET  /stats       -> request counts, latency percentiles and cache stats  #
+#                        (and the stage timings, with --profile)              #
+###############################################################################
+OUTPUT_FORMATS = {"wav": "audio/wav", "raw": "application/octet-stream"}
+# number of recent requests the latency percentiles are computed over
+LATENCY_WINDOW = 1000
+# speaking rates a request may ask for
+SPEAKING_RATES = (0.25, 4.0)
+
+try:
+    string_types = basestring
+except NameError:  # python 3
+    string_types = str
+
+
+# function that converts a numeric request option
+# input: option value, option name (string), output: value (float)
+# raises ValueError for values that are not numbers, e.g. lists or objects
+def to_float(value, name):
+    if isinstance(value, (bool, list, dict)):
+        raise ValueError("%s must be a number" % name)
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError("%s must be a number" % name)
+
+
+"""
+Synthesis service class
+object in the class holds the loaded voice and the request statistics,
+it is shared by every request handler thread (the phone data and lexicon are only ever read)
+"""
+class SynthesisService(object):
+    def __init__(self, wav_folder, rate=16000, utterance_cache=None, memo_bytes=synthesizer.WORD_MEMO_BYTES):
+        self.synth = synthesizer.Synth(wav_folder=wav_folder, rate=rate, memo_bytes=memo_bytes)
+        self.cache = utterance_cache  # cache.UtteranceCache shared by every request, or None
+        lexicon.get_lexicon()  # load the lexicon now rather than in the first request
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)  # seconds, most recent requests
+        self.first_audio = deque(maxlen=LATENCY_WINDOW)  # seconds to the first chunk, most recent streamed requests
+        self.lock = threading.Lock()
+
+    # function that checks the options of a request
+    # input: request options (dict), output: (phrase, spell, volume, output format, speaking rate)
+    # raises ValueError for invalid requests
+    def parse_options(self, options):
+        phrase = options.get("phrase")
+        if not phrase:
+            raise ValueError("phrase is required")
+        if not isinstance(phrase, string_types):
+            raise ValueError("phrase must be a string")
+        spell = options.get("spell", False)
+        if spell not in (True, False, None):  # also accepts 0 and 1
+            raise ValueError("spell must be true or false")
+        output_format = options.get("format", "wav")
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError("format must be one of %s" % ", ".join(sorted(OUTPUT_FORMATS)))
+        volume = options.get("volume")
+        if volume is not None:
+            volume = to_float(volume, "volume")
+        speaking_rate = options.get("speaking_rate")
+        if speaking_rate is not None:
+            speaking_rate = to_float(speaking_rate, "speaking_rate")
+            if not SPEAKING_RATES[0] <= speaking_rate <= SPEAKING_RATES[1]:
+                raise ValueError("speaking_rate must be between %g and %g" % SPEAKING_RATES)
+        return phrase, bool(spell), volume, output_format, speaking_rate
+
+    # function that synthesises one request
+    # input: request options (dict), output: (audio bytes, content type)
+    def synthesize(self, options):
+        phrase, spell, volume, output_format, speaking_rate = self.parse_options(options)
+        with instrument.Stage("synthesize"):
+            out = synthesizer.synthesize(self.synth, phrase, spell=spell, volume=volume, cache=self.cache,
+                                         speaking_rate=speaking_rate)
+        if output_format == "raw":
+            return out.data.tobytes(), OUTPUT_FORMATS["raw"]
+        buf = io.BytesIO()
+        with instrument.Stage("save"):
+            out.save(buf)
+        return buf.getvalue(), OUTPUT_FORMATS["wav"]
+
+    # function that synthesises one request incrementally
+    # input: request options (dict), output: (iterator of audio bytes, content type)
+    def stream(self, options):
+        phrase, spell, volume, output_format, speaking_rate = self.parse_options(options)
+        chunks = synthesizer.stream_synthesis(self.synth, phrase, spell=spell, volume=volume,
+                                              speaking_rate=speaking_rate)
+        # render the first chunk now, so errors in the phrase (e.g. one without anything to say)
+        # are reported with the same status as by synthesize, before the response starts
+        first = next(chunks)
+
+        def generate():
+            if output_format == "wav":
+                # the length is not known yet, so the header carries the maximum sizes
+                yield SA.wav_header(1, self.synth.rate, 2)
+            yield first.tobytes()
+            for chunk in chunks:
+                yield chunk.tobytes()
+        return generate(), OUTPUT_FORMATS[output_format]
+
+    # function that records the outcome of a request
+    # input: time taken in seconds (float), whether the request failed (bool),
+    #        time to the first chunk of a streamed request in seconds (float)
+    def record(self, latency, failed, first_audio=None):
+        with self.lock:
+            self.requests += 1
+            if failed:
+                self.errors += 1
+            else:
+                self.latencies.append(latency)
+                if first_audio is not None:
+                    self.first_audio.append(first_audio)
+
+    # function that summarises the request statistics
+    # output: dict
+    def stats(self):
+        with self.lock:
+            windows = {"latency_ms": np.array(self.latencies), "first_audio_ms": np.array(self.first_audio)}
+            stats = {"requests": self.requests,
+                     "errors": self.errors,
+                     "uptime": time.time() - self.started}
+        for name, seconds in windows.items():
+            if len(seconds):
+                stats[name] = {"mean": seconds.mean() * 1000,
+                               "p50": np.percentile(seconds, 50) * 1000,
+                               "p95": np.percentile(seconds, 95) * 1000,
+                               "max": seconds.max() * 1000}
+        if self.cache is not None:
+            stats["cache"] = self.cache.stats()
+        if self.synth.word_memo is not None:
+            stats["word_memo"] = self.synth.word_memo.stats()
+        stats["letter_to_sound"] = lts.stats()
+        if instrument.is_enabled():
+            stats["profile"] = instrument.report()
+        return stats
+
+
+"""
+Request handler class
+object in the class handles a single HTTP request, using the service attached to the server
+"""
+class SynthesisRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == "/health":
+            self.send_json(200, {"status": "ok", "uptime": time.time() - service.started})
+        elif self.path == "/stats":
+            self.send_json(200, service.stats())
+        else:
+            self.send_json(404, {"error": "unknown path %s" % self.path})
+
+    def do_POST(self):
+        if self.path != "/synthesize":
+            self.send_json(404, {"error": "unknown path %s" % self.path})
+            return
+        service = self.server.service
+        start = time.time()
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            options = json.loads(self.rfile.read(length).decode("utf-8"))
+            if not isinstance(options, dict):
+                raise ValueError("request body must be a json object")
+            if options.get("stream"):
+                chunks, content_type = service.stream(options)
+            else:
+                body, content_type = service.synthesize(options)
+        except (ValueError, KeyError) as e:
+            service.record(time.time() - start, True)
+            self.send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            service.record(time.time() - start, True)
+            self.log_error("synthesis failed: %r", e)
+            self.send_json(500, {"error": "internal error: %s" % e})
+            return
+        if options.get("stream"):
+            try:
+                first_audio = self.send_chunked(200, chunks, content_type, start)
+            except Exception:
+                # the response has already started, so the only way left to report
+                # a failure is to drop the connection before the final chunk
+                self.close_connection = True
+                service.record(time.time() - start, True)
+                return
+            service.record(time.time() - start, False, first_audio)
+        else:
+            service.record(time.time() - start, False)
+            self.send_body(200, body, content_type)
+
+    def send_json(self, code, obj):
+        self.send_body(code, json.dumps(obj, sort_keys=True).encode("utf-8"), "application/json")
+
+    def send_body(self, code, body, content_type):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # function that sends a response with chunked transfer encoding, writing each chunk as it is made
+    # input: status code (int), iterator of bytes, content type (string), start time of the request (float)
+    # output: seconds from the start of the request to the first audio chunk being sent (float)
+    def send_chunked(self, code, chunks, content_type, start):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        first_audio = None
+        for chunk in chunks:
+            self.wfile.write(("%x\r\n" % len(chunk)).encode("ascii") + chunk + b"\r\n")
+            self.wfile.flush()
+            if first_audio is None:
+                first_audio = time.time() - start
+        self.wfile.write(b"0\r\n\r\n")
+        return first_audio
+
+    # Unix socket clients have no address, so don't try to log one
+    def address_string(self):
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            sys.stderr.write("%s - - [%s] %s\n" % (self.address_string(), self.log_date_time_string(), format % args))
+
+
+# one thread per connection, so a long phrase does not hold up other clients
+class ThreadingSynthesisServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixSynthesisServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+# function that creates a server for a service, listening on a Unix socket if one is given
+# and on localhost otherwise
+# input: SynthesisService object, port (int), socket path (string or None), output: server object
+def make_server(service, port=8765, socket_path=None, quiet=False):
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixSynthesisServer(socket_path, SynthesisRequestHandler)
+    else:
+        server = ThreadingSynthesisServer(("127.0.0.1", port), SynthesisRequestHandler)
+    server.service = service
+    server.quiet = quiet
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve speech synthesis requests from a warm synthesizer.')
+    parser.add_argument('--monophones', default="monophones", help="Folder or bank containing monophone wavs")
+    parser.add_argument('--port', default=8765, type=int, help="Localhost port to listen on")
+    parser.add_argument('--socket', default=None, help="Listen on this Unix socket instead of a port")
+    parser.add_argument('--quiet', '-q', action="store_true", default=False, help="Don't log requests")
+    parser.add_argument('--cache-dir', default=None, help="Directory to cache synthesised utterances in")
+    parser.add_argument('--cache-size', default=256, type=float, help="Size limit of the cache directory in MB")
+    parser.add_argument('--rate', default=16000, type=int, help="Sample rate of the output audio")
+    parser.add_argument('--user-lexicon', default=None,
+                        help="Pronunciation file for words missing from cmudict, letter-to-sound results are added to it")
+    parser.add_argument('--memo-size', default=synthesizer.WORD_MEMO_BYTES / 2.0**20, type=float,
+                        help="Memory for rendered words reused across requests in MB (0 to disable)")
+    parser.add_argument('--profile', action="store_true", default=False,
+                        help="Time each stage of every request and report it (and the memory used) in /stats")
+    args = parser.parse_args()
+
+    if args.profile:
+        instrument.enable()
+        instrument.record("imports", synthesizer.import_seconds)
+
+    lts.set_user_lexicon(args.user_lexicon)
+    utterance_cache = None
+    if args.cache_dir is not None:
+        utterance_cache = cache.UtteranceCache(args.cache_dir, int(args.cache_size * 2**20))
+    service = SynthesisService(args.monophones, rate=args.rate, utterance_cache=utterance_cache,
+                               memo_bytes=int(args.memo_size * 2**20))
+    server = make_server(service, args.port, args.socket, args.quiet)
+    print("listening on %s" % (args.socket or "http://127.0.0.1:%d" % args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket is not None and os.path.exists(args.socket):
+            os.remove(args.socket)
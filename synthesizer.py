@@ -1,11 +1,22 @@
+from __future__ import print_function
+import instrument
+_import_start = instrument.timer()
 import os
 import sys
 import SimpleAudio as SA
+import phonebank
+import lexicon
+import lts
 import argparse
 import numpy as np
 import re
-import nltk
-from datetime import datetime
+import json
+import hashlib
+import cache
+import threading
+from collections import OrderedDict
+# time taken by the imports above, recorded by --profile
+import_seconds = instrument.timer() - _import_start
 
 ### NOTE: DO NOT CHANGE ANY OF THE EXISITING ARGUMENTS
 parser = argparse.ArgumentParser(
@@ -21,8 +32,19 @@ parser.add_argument('--spell', '-s', action="store_true", default=False,
                     help="Spell the phrase instead of pronouncing it")
 parser.add_argument('--volume', '-v', default=None, type=float,
                     help="A float between 0.0 and 1.0 representing the desired volume")
-
-args = parser.parse_args()
+parser.add_argument('--stdout', default=None, choices=["wav", "raw"],
+                    help="Stream the output audio to stdout as it is synthesised, as a wav or as raw 16 bit PCM")
+parser.add_argument('--cache-dir', default=None,
+                    help="Directory of previously synthesised utterances to reuse (and add to)")
+parser.add_argument('--cache-size', default=256, type=float, help="Size limit of the cache directory in MB")
+parser.add_argument('--user-lexicon', default=None,
+                    help="Pronunciation file for words missing from cmudict, letter-to-sound results are added to it")
+parser.add_argument('--speaking-rate', default=None, type=float,
+                    help="Speed of the speech relative to the recordings, e.g. 0.8 for slower or 1.5 for faster")
+parser.add_argument('--rate', default=16000, type=int,
+                    help="Sample rate of the output audio, the monophones are resampled to it when they differ")
+parser.add_argument('--profile', nargs='?', const='-', default=None,
+                    help="Write the time taken by each stage and the memory used as json to this file (default: stderr)")
 
 ############################################################################
 # Section for regular expressions                                          #
@@ -48,70 +70,578 @@ date_number_punctuation_pattern = r"""
 date_pattern = r"\d?\d/\d?\d(?:/(?:\d\d)?\d\d)?"
 number_pattern = r"\d+(?:\.\d+)?"
 
-# print args # for testing purpose
-print args.monophones
+# date_number_punctuation_pattern compiled once, with a named group for each kind of token,
+# so a single scan both tokenizes the phrase and classifies the tokens
+token_pattern = re.compile(r"(?P<date>%s)|(?P<number>%s)|(?P<word>\w+)|(?P<punctuation>[!?.,])"
+                           % (date_pattern, number_pattern), re.UNICODE | re.MULTILINE | re.DOTALL)
 
 
 ###############################
 # Section for audio synthesis #
 ###############################
+# default size of the memo of rendered words kept by each Synth object
+WORD_MEMO_BYTES = 16 * 2**20
+# number of resampled phone inventories kept for reuse by later Synth objects
+RESAMPLED_INVENTORIES = 8
+_resampled_inventories = OrderedDict()  # key: (voice hash, rate), value: dict of phone name -> samples
+_resampled_lock = threading.Lock()
+
 """
 Synthesis class
 Object in the class is used for processing speech
 given the word/letter pronunciation sequence, generate corresponding audio data
 """
 class Synth(object):
-    def __init__(self, wav_folder, rate, sp_time=250, lp_time=500):
+    def __init__(self, wav_folder, rate, sp_time=250, lp_time=500, memo_bytes=WORD_MEMO_BYTES):
         self.phones = {} # phones used for synthesis (key: phone name, value:audio object)
         self.rate = rate        # synthesis rate, equal to the rate of the pronunciation files used
         self.sp_time = sp_time  # set time for short pause for speech
         self.lp_time = lp_time  # set time for long pause for speech
+        self.bank = None        # packed phone bank the phones are served from (None when loaded from a folder)
+        self.resampled = False  # whether any phone was converted from the rate it was recorded at
+        # rendered words kept for reuse across phrases (None when memo_bytes is 0)
+        self.word_memo = WordMemo(memo_bytes) if memo_bytes else None
         self.get_wavs(wav_folder) # from the files given, load the audio files, and store in the phone dictionary.
                                   # It should be in the last, orders do matter
+        instrument.set_bytes("phones", self.nbytes())
     # function that load all audio data (all possible pronunciation audio files) into the synthesis object
-    # input: path of wav_floder (string), outpur: non empty self.phones attribute
+    # phones recorded at another rate are converted to the synthesis rate
+    # input: path of wav_floder (string) or of a bank built by phonebank.py, outpur: non empty self.phones attribute
+    @instrument.timed("get_wavs")
     def get_wavs(self, wav_folder):
-        for root, dirs, files in os.walk(wav_folder, topdown=False): # loading phonemes from file
-            for file in files: # file names -> str
-                phone_name = file.split('.')[0]
-                self.phones[phone_name] = SA.Audio() # each phone name as each phone object
-                self.phones[phone_name].load(os.path.join(wav_folder, file))
+        if phonebank.is_bank(wav_folder):
+            self.load_bank(wav_folder)
+        else:
+            self.load_folder(wav_folder)
+        self.resample_phones()
         # load for short pause and long pause, and create data (salience) (for punctuation)
         # reference: add echo method in SimpleAudio
         self.phones["sp"] = SA.Audio(rate=self.rate)
         self.phones["sp"].data = np.zeros(self.sample_converter(self.sp_time), self.phones["sp"].nptype)
         self.phones["lp"] = SA.Audio(rate=self.rate)
         self.phones["lp"].data = np.zeros(self.sample_converter(self.lp_time), self.phones["lp"].nptype)
+        self.index_phones()
+
+    # function that gives every phone a small integer id and builds the per-id tables used by concatenate:
+    #   self.samples - packed buffer holding the samples of every phone back to back (the bank itself,
+    #                  when loaded from a bank, in which case the pauses are not part of it)
+    #   self.offsets - start of each phone in self.samples (-1 for phones outside it)
+    #   self.lengths - number of samples of each phone
+    # the ids are those of the lexicon's phone table (followed by any other phones of the voice),
+    # so the phone ids looked up in the lexicon are used as they are;
+    # phones of the table the voice has no recording of are empty and marked in self.missing
+    # after packing, the data of every phone in self.phones is a view into self.samples
+    def index_phones(self):
+        table = lexicon.get_lexicon().phone_table
+        self.phone_names = table + sorted(set(self.phones) - set(table))  # phone id -> phone name
+        self.phone_ids = dict((name, i) for i, name in enumerate(self.phone_names))  # phone name -> phone id
+        self.missing = np.array([name not in self.phones for name in self.phone_names])
+        empty = np.array([], self.phones["sp"].nptype)
+        data = [self.phones[name].data if name in self.phones else empty for name in self.phone_names]
+        self.lengths = np.array([len(phone_data) for phone_data in data], np.intp)
+        if self.bank is not None and not self.resampled:
+            self.samples = self.bank.samples
+            self.offsets = np.array([self.bank.index[name][0] if name in self.bank else -1
+                                     for name in self.phone_names], np.intp)
+        else:
+            self.samples = np.concatenate(data)
+            self.offsets = np.cumsum(self.lengths) - self.lengths
+            for name, offset, length in zip(self.phone_names, self.offsets, self.lengths):
+                if name in self.phones:
+                    self.phones[name].data = self.samples[offset:offset + length]
+        self.unit_data = [self.phones[name].data if name in self.phones else empty
+                          for name in self.phone_names]  # phone id -> samples
+
+    # function that converts a phone sequence into phone ids
+    # input: phone sequence (list of string), output: phone ids (numpy int array)
+    def encode(self, phone_seq):
+        phone_ids = self.phone_ids
+        return np.array([phone_ids[phone] for phone in phone_seq], np.intp)
+
+    # function that converts phone ids back into phone names, e.g. for the utterance cache key
+    # input: phone ids (numpy int array), output: phone sequence (list of string)
+    def decode(self, phone_ids):
+        phone_names = self.phone_names
+        return [phone_names[i] for i in phone_ids.tolist()]
+
+    # function that loads every wav of a monophone folder, one file per phone
+    # input: path of wav_floder (string)
+    def load_folder(self, wav_folder):
+        for root, dirs, files in os.walk(wav_folder, topdown=False): # loading phonemes from file
+            for file in files: # file names -> str
+                phone_name = file.split('.')[0]
+                self.phones[phone_name] = SA.Audio() # each phone name as each phone object
+                self.phones[phone_name].load(os.path.join(wav_folder, file))
+
+    # function that converts every phone recorded at another rate than the synthesis rate, once at load time
+    # rather than for every utterance, the converted phones are kept per (voice, rate) so that
+    # other Synth objects of the same voice and rate reuse them
+    def resample_phones(self):
+        mismatched = sorted(name for name, phone in self.phones.items() if phone.rate != self.rate)
+        if not mismatched:
+            return
+        key = (self.source_hash(), self.rate)
+        with _resampled_lock:
+            inventory = _resampled_inventories.pop(key, None)
+        if inventory is None:
+            inventory = {}
+            for name in mismatched:
+                phone = SA.Audio(channels=self.phones[name].chan, rate=self.phones[name].rate)
+                phone.data = self.phones[name].data
+                phone.resample(self.rate)
+                phone.data.flags.writeable = False  # shared with every Synth object of this voice and rate
+                inventory[name] = phone.data
+        with _resampled_lock:
+            _resampled_inventories[key] = inventory  # (re)insert as most recently used
+            while len(_resampled_inventories) > RESAMPLED_INVENTORIES:
+                _resampled_inventories.popitem(last=False)
+        for name in mismatched:
+            self.phones[name].data = inventory[name]
+            self.phones[name].rate = self.rate
+        self.resampled = True
+
+    # function that opens a packed phone bank with a single mmap,
+    # every phone's data is a view into the bank rather than a copy
+    # input: path of the bank file (string)
+    def load_bank(self, bank_path):
+        self.bank = phonebank.PhoneBank(bank_path)
+        for phone_name in self.bank.names():
+            self.phones[phone_name] = self.bank.audio(phone_name)
 
     # concatenate a audio data sequence into a single output data
-    # input: list of audio data (i.e. a list of numpy array), output: a single audio data (i.e. a single numpy array)
+    # the output is allocated once from the length table and filled with a single copy of every phone
+    # input: phone sequence (phone ids, or list of string), output: a single audio data (i.e. a single numpy array)
     # reference:
     # http://stackoverflow.com/questions/9236926/concatenating-two-one-dimensional-numpy-arrays
+    @instrument.timed("concatenate")
     def concatenate(self, phone_seq):
-        data_sequnce = []
-        for phone in phone_seq:
-            data_sequnce.append(self.phones[phone].data)
-        return np.concatenate(data_sequnce)
+        phone_ids = phone_seq if isinstance(phone_seq, np.ndarray) else self.encode(phone_seq)
+        if len(phone_ids) == 0:
+            raise ValueError("need at least one phone to concatenate")
+        if self.missing[phone_ids].any():
+            raise KeyError(self.phone_names[phone_ids[self.missing[phone_ids]][0]])
+        out = np.empty(self.lengths[phone_ids].sum(), self.samples.dtype)
+        unit_data = self.unit_data
+        return np.concatenate([unit_data[i] for i in phone_ids.tolist()], out=out)
+
+    # function that finds where the phones of a concatenation join, for quality checks (see Audio.join_summary)
+    # input: phone sequence (phone ids, or list of string)
+    # output: sample index of the first sample of every phone but the first (numpy int array)
+    def join_positions(self, phone_seq):
+        phone_ids = phone_seq if isinstance(phone_seq, np.ndarray) else self.encode(phone_seq)
+        return np.cumsum(self.lengths[phone_ids])[:-1]
+
+    # function that renders a single word token (or punctuation), reusing the rendering
+    # of an earlier phrase when the word memo holds it
+    # input: normalised word token (string), spell flag (bool),
+    #        phone ids of the word when they have already been looked up (numpy int array or None)
+    # output: (phone ids (read-only numpy int array), audio data (read-only numpy array, empty for
+    #         tokens without phones))
+    def render_word(self, word, spell=False, phones=None):
+        memo = self.word_memo
+        key = (word, bool(spell))
+        if memo is not None:
+            rendered = memo.get(key)
+            if rendered is not None:
+                return rendered
+        if phones is None:
+            phones = get_phone_seq(word, spell)
+        if len(phones):
+            data = self.concatenate(phones)
+        else:
+            data = np.array([], self.samples.dtype)
+        phones.flags.writeable = False  # shared by every phrase containing the word
+        data.flags.writeable = False
+        if memo is not None:
+            memo.put(key, (phones, data))
+        return phones, data
+
+    # function that joins rendered words into a single output data, copying each word once
+    # input: audio data of each word (list of numpy arrays), output: a single audio data (numpy array)
+    @instrument.timed("concatenate")
+    def join(self, word_data):
+        length = sum(len(data) for data in word_data)
+        if length == 0:
+            raise ValueError("need at least one phone to concatenate")
+        out = np.empty(length, self.samples.dtype)
+        return np.concatenate(word_data, out=out)
+
+    # function that renders phone groups (e.g. the phones of one word each) incrementally
+    # and yields the result in fixed size chunks as soon as each chunk is full,
+    # so the time to the first chunk does not depend on the length of the input
+    # input: iterable of phone sequences (phone ids, or list of string), chunk size in samples (int),
+    #        volume between 0.0 and 1.0 or None (float), reference peak for the volume (see stream_data)
+    # output: iterator of audio data (numpy arrays of chunk_size samples, the last one may be shorter)
+    def stream(self, phone_groups, chunk_size=4096, volume=None, peak=None):
+        rendered = (self.concatenate(phones) for phones in phone_groups if len(phones))
+        return self.stream_data(rendered, chunk_size, volume, peak)
+
+    # function that re-chunks already rendered audio data, see stream
+    # input: iterable of audio data (numpy arrays), chunk size in samples (int),
+    #        volume between 0.0 and 1.0 or None (float),
+    #        peak the volume is relative to (int, e.g. phrase_peak of the phrase, None for the loudest phone of the voice)
+    # output: iterator of audio data (numpy arrays of chunk_size samples, the last one may be shorter),
+    #         raises ValueError when there is no audio at all, as synthesize does
+    # with the phrase peak the result is the same as Audio.rescale gives in synthesize
+    def stream_data(self, data_groups, chunk_size=4096, volume=None, peak=None):
+        if volume is not None and not 0 <= volume <= 1:
+            raise ValueError("Expected scaling factor between 0 and 1")
+        nptype = self.phones["sp"].nptype
+        if peak is None:
+            peak = self.peak()
+        gain = None if volume is None or peak == 0 else volume / (peak / SA.format_scale(self.phones["sp"].format))
+        chunk = np.empty(chunk_size, nptype)
+        filled = 0
+        total = 0
+        for data in data_groups:
+            if gain is not None:
+                data = self.apply_gain(data, gain)
+            total += len(data)
+            position = 0
+            while position < len(data):
+                count = min(chunk_size - filled, len(data) - position)
+                chunk[filled:filled + count] = data[position:position + count]
+                filled += count
+                position += count
+                if filled == chunk_size:
+                    yield chunk
+                    chunk = np.empty(chunk_size, nptype)
+                    filled = 0
+        if total == 0:
+            # as synthesize does, so a phrase is rejected the same way whether it is streamed or not
+            raise ValueError("need at least one phone to concatenate")
+        if filled:
+            yield chunk[:filled]
+
+    # function that scales audio data the way synthesize applies the volume: in float32, converted
+    # back to the format of the voice with rounding and clipping, so that streamed and whole
+    # phrases come out at the same level
+    # input: audio data (numpy array), gain (float), output: scaled audio data (numpy array)
+    def apply_gain(self, data, gain):
+        voice_format = self.phones["sp"].format
+        array = SA.convert_samples(data, voice_format, SA.paFloat32)
+        array = np.multiply(array, gain, dtype=np.float32)
+        return SA.convert_samples(array, SA.paFloat32, voice_format)
+
+    # function that finds the loudest sample of every phone, computed once
+    # output: peak absolute amplitude of each phone id (numpy int array, 0 for empty phones)
+    def phone_peaks(self):
+        if getattr(self, "_phone_peaks", None) is None:
+            self._phone_peaks = np.array([max(int(data.max()), -int(data.min())) if len(data) else 0
+                                          for data in self.unit_data], np.int64)
+        return self._phone_peaks
+
+    # function that finds the loudest sample of a phrase from its phones, without rendering it
+    # input: phone ids (numpy int array), output: peak absolute amplitude (int, 0 for silence)
+    def phrase_peak(self, phone_ids):
+        return int(self.phone_peaks()[phone_ids].max()) if len(phone_ids) else 0
+
+    # function that finds the loudest sample of any phone, computed once
+    # output: peak absolute amplitude (int, at least 1)
+    def peak(self):
+        return max(1, int(self.phone_peaks().max()))
 
     # a method that convert time(ms) into the number samples
     # input: time in illisecond (int), output: number of samples (int)
     def sample_converter(self, time):  # time in milliseconds, rate s^-1
         return int((time / 1000.0) * self.rate)
 
+    # function that reports the memory held by the phone data
+    # phones are views into the packed buffer, so it is only counted once
+    # output: size in bytes (int)
+    def nbytes(self):
+        outside = sum(self.unit_data[i].nbytes for i in np.flatnonzero(self.offsets < 0))
+        return self.samples.nbytes + outside
+
+    # function that reports all the memory held by this object: the phone data and the word memo
+    # output: size in bytes (int)
+    def resident_bytes(self):
+        return self.nbytes() + (self.word_memo.bytes if self.word_memo is not None else 0)
+
+    # function that identifies the recorded phones, computed once (before they are resampled):
+    # the bank's own hash when loaded from a bank, otherwise the hash the bank built from the folder would have
+    # output: hex digest (string)
+    def source_hash(self):
+        if getattr(self, "_source_hash", None) is None:
+            if self.bank is not None:
+                self._source_hash = self.bank.content_hash
+            else:
+                # hash the phones as phonebank.build_bank would pack them, so that a folder
+                # and the bank built from it are recognised as the same voice
+                names = sorted(name for name in self.phones if name not in ("sp", "lp"))
+                lengths = [len(self.phones[name].data) for name in names]
+                offsets = np.cumsum([0] + lengths)
+                index = dict((name, [int(offset), length, self.phones[name].rate])
+                             for name, offset, length in zip(names, offsets, lengths))
+                self._source_hash = phonebank.content_hash(index, np.concatenate([self.phones[name].data for name in names]))
+        return self._source_hash
+
+    # function that identifies the audio this object can produce, computed once:
+    # a hash of the recorded phones, the rate and the pause lengths
+    # output: hex digest (string)
+    def content_hash(self):
+        if getattr(self, "_content_hash", None) is None:
+            h = hashlib.sha1()
+            h.update(self.source_hash().encode('utf-8'))
+            h.update(json.dumps([self.rate, self.sp_time, self.lp_time]).encode('utf-8'))
+            self._content_hash = h.hexdigest()
+        return self._content_hash
+
+
+"""
+Voice registry class
+object in the class serves many voices (monophone folders or banks) from one process
+a voice is registered by name and only loaded into a Synth object the first time it is used,
+when the loaded voices exceed the byte budget the least recently used ones are unloaded
+"""
+class VoiceRegistry(object):
+    def __init__(self, rate, max_bytes=None):
+        self.rate = rate                # synthesis rate of every Synth the registry creates
+        self.max_bytes = max_bytes      # budget for the phone data and word memos of loaded voices (None for no limit)
+        self.voices = {}                # registered voices (key: voice name, value: (path, Synth keyword arguments))
+        self.loaded = OrderedDict()     # loaded voices, least recently used first (key: voice name, value: Synth object)
+        self.hits = {}                  # number of requests served by an already loaded voice (key: voice name)
+        self.misses = {}                # number of requests that had to load the voice (key: voice name)
+        self.lock = threading.Lock()
+
+    # function that registers a voice without loading it
+    # input: voice name (string), path of a monophone folder or bank (string), extra Synth arguments (e.g. sp_time)
+    def register(self, name, wav_folder, **synth_args):
+        with self.lock:
+            self.voices[name] = (wav_folder, synth_args)
+            self.hits.setdefault(name, 0)
+            self.misses.setdefault(name, 0)
+            # a re-registered voice must be reloaded from its new location
+            self.loaded.pop(name, None)
+
+    # function that returns the Synth object of a voice, loading it on first use
+    # the voice is loaded without holding the lock, so a slow load does not hold up requests
+    # for other voices; if two threads load the same voice at once, the first one loaded is kept
+    # input: voice name (string), output: Synth object
+    def get(self, name):
+        with self.lock:
+            if name not in self.voices:
+                raise KeyError("voice %s is not registered" % name)
+            if name in self.loaded:
+                self.hits[name] += 1
+                synth = self.loaded.pop(name)
+                self.loaded[name] = synth  # reinsert as most recently used
+                self.evict_to_budget()
+                return synth
+            self.misses[name] += 1
+            registration = self.voices[name]
+        wav_folder, synth_args = registration
+        synth = Synth(wav_folder=wav_folder, rate=self.rate, **synth_args)
+        with self.lock:
+            if name in self.loaded:
+                synth = self.loaded.pop(name)  # loaded by another thread in the meantime
+            elif self.voices.get(name) is not registration:
+                return synth  # re-registered while loading, so not kept
+            self.loaded[name] = synth  # (re)insert as most recently used
+            self.evict_to_budget()
+            return synth
+
+    # function that unloads least recently used voices until the budget is met,
+    # the most recently used voice is always kept, even if it exceeds the budget alone
+    def evict_to_budget(self):
+        if self.max_bytes is None:
+            return
+        while len(self.loaded) > 1 and self.resident_bytes() > self.max_bytes:
+            self.loaded.popitem(last=False)
+
+    # function that reports the memory held by all loaded voices
+    # output: size in bytes (int)
+    def resident_bytes(self):
+        return sum(synth.resident_bytes() for synth in self.loaded.values())
+
+    # function that reports the state of every registered voice
+    # output: dict (key: voice name, value: dict of loaded, bytes, hits and misses)
+    def stats(self):
+        with self.lock:
+            return dict((name, {"loaded": name in self.loaded,
+                                "bytes": self.loaded[name].resident_bytes() if name in self.loaded else 0,
+                                "hits": self.hits[name],
+                                "misses": self.misses[name]}) for name in self.voices)
+
+
+"""
+Word memo class
+object in the class keeps the most recently rendered words of a voice, so phrases that share
+their vocabulary (menus, number readouts) only render the words that have not been seen before
+entries are (phone sequence, audio data) pairs, the least recently used are dropped when
+the audio data exceeds the byte capacity
+"""
+class WordMemo(object):
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes      # capacity for the audio data of the memoized words
+        self.entries = OrderedDict()    # least recently used first (key: (word, spell flag), value: (phones, data))
+        self.bytes = 0                  # audio data currently held
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    # function that looks up a rendered word
+    # input: key (tuple), output: (phone sequence, audio data), or None on a miss
+    def get(self, key):
+        with self.lock:
+            rendered = self.entries.pop(key, None)
+            if rendered is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries[key] = rendered  # reinsert as most recently used
+            return rendered
+
+    # function that stores a rendered word, then drops the least recently used words until it fits
+    # words larger than the whole capacity are not stored
+    # input: key (tuple), (phone sequence, audio data) (tuple)
+    def put(self, key, rendered):
+        size = rendered[1].nbytes
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1].nbytes
+            self.entries[key] = rendered
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self.bytes -= self.entries.popitem(last=False)[1][1].nbytes
+
+    # function that empties the memo, e.g. after the voice data changed
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    # function that reports the memo statistics
+    # output: dict
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"words": len(self.entries),
+                    "bytes": self.bytes,
+                    "max_bytes": self.max_bytes,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "hit_ratio": float(self.hits) / lookups if lookups else 0.0}
+
 
 #####################################################################################################
 # Section for language processing,                                                                  #
 # it contains 4 classes:                                                                            #
 # Word_to_phone_seq_generator, Letter_to_phone_seq_generator, Number_normalizer and Date_normalizer #
 #####################################################################################################
-# function check if -s appear in the command line or not
+# function check if the phrase should be spelled (-s on the command line) or not
 # distinguish whether the pronunciation is spelling or word pronunciation
-def get_phone_seq(phrase):
-    if args.spell:
-        return Letter_to_phone_sequence_generator(Word_to_phone_seq_generator(phrase).word_tokens).letter_phone_seq
+def get_phone_seq(phrase, spell=False):
+    if spell:
+        return Letter_to_phone_sequence_generator(normalize_text(phrase)).letter_phone_seq
     else:
         return Word_to_phone_seq_generator(phrase).word_phone_seq
 
+# function that flattens per word (or per letter) phone ids into a single phone sequence
+# input: list of phone ids (list of numpy int arrays), output: phone ids (numpy int array)
+def normalise_phone_seq(phone_sequence):
+    if not phone_sequence:
+        return np.array([], np.intp)
+    return np.concatenate(phone_sequence).astype(np.intp, copy=False)
+
+# function that normalizes a phrase one input token at a time, in a single scan of the phrase
+# words and punctuation are lower cased, numbers and dates are expanded into the words they are read as
+# input: phrase (string), output: iterator of word groups, one per input token (tuple of string)
+def iter_word_groups(phrase):
+    for match in token_pattern.finditer(phrase):
+        kind = match.lastgroup
+        if kind == "word" or kind == "punctuation":
+            yield (match.group().lower(),)
+        else:
+            yield expand_token(kind, match.group())
+
+# function that normalizes a phrase into word tokens (words and punctuation), see iter_word_groups
+# input: phrase (string), output: list of words (list of string)
+@instrument.timed("normalize_text")
+def normalize_text(phrase):
+    return [word for words in iter_word_groups(phrase) for word in words]
+
+# function that runs the whole pipeline: phrase -> phone sequence -> audio (-> time stretched audio -> rescaled audio)
+# when the Synth object has a word memo the phrase is assembled from rendered words,
+# so only words that are not in the memo are looked up and rendered
+# input: Synth object, phrase (string), spell flag (bool), volume between 0.0 and 1.0 or None (float),
+#        utterance cache to look the result up in and store it to (cache.UtteranceCache or None),
+#        speaking rate (float, e.g. 1.5 is one and a half times as fast, None or 1.0 for the recorded rate)
+# output: synthesised audio (Audio object)
+def synthesize(synth, phrase, spell=False, volume=None, cache=None, speaking_rate=None):
+    if speaking_rate == 1:
+        speaking_rate = None
+    if synth.word_memo is not None:
+        words = normalize_text(phrase)
+        word_phones = [None] * len(words)
+        if cache is not None:
+            # the key needs the phones of the phrase, the audio is only rendered on a miss
+            word_phones = [get_phone_seq(word, spell) for word in words]
+            phone_seq = normalise_phone_seq(word_phones)
+    else:
+        phone_seq = get_phone_seq(phrase, spell)
+    if cache is not None:
+        key = cache.key(synth.decode(phone_seq), spell, volume, synth.content_hash(), speaking_rate)
+        out = cache.get(key)
+        if out is not None:
+            return out
+    out = SA.Audio(rate=synth.rate)
+    if synth.word_memo is not None:
+        out.data = synth.join([synth.render_word(word, spell, phones)[1] for word, phones in zip(words, word_phones)])
+    else:
+        out.data = synth.concatenate(phone_seq)
+    if speaking_rate is not None or volume is not None:
+        # processed in float32, and converted back to the format of the voice once at the end
+        voice_format = out.format
+        out.to_format(SA.paFloat32)
+        if speaking_rate is not None:
+            with instrument.Stage("time_stretch"):
+                out.time_stretch_fft(speaking_rate)
+        if volume is not None: # ValueError will be handled by SA
+            with instrument.Stage("rescale"):
+                out.rescale(volume)
+        out.to_format(voice_format)
+    if cache is not None:
+        cache.put(key, out)
+    return out
+
+# function that generates the phone sequence of a phrase one input token at a time
+# (a token is a word, number, date or punctuation of the phrase, numbers and dates
+# give the phones of all the words they expand to), without processing the whole phrase first
+# input: phrase (string), spell flag (bool), output: iterator of phone sequences (numpy int arrays of phone ids)
+def iter_phone_seqs(phrase, spell=False):
+    for match in token_pattern.finditer(phrase):
+        yield get_phone_seq(match.group(), spell)
+
+# function that runs the whole pipeline incrementally, see Synth.stream
+# input: Synth object, phrase (string), spell flag (bool), volume between 0.0 and 1.0 or None (float),
+#        chunk size in samples (int), speaking rate (float or None)
+# output: iterator of audio data chunks (numpy arrays)
+def stream_synthesis(synth, phrase, spell=False, volume=None, chunk_size=4096, speaking_rate=None):
+    if speaking_rate is not None and speaking_rate != 1:
+        # the time stretch works on the whole phrase, so it is rendered before the first chunk
+        out = synthesize(synth, phrase, spell=spell, volume=volume, speaking_rate=speaking_rate)
+        return synth.stream_data([out.data], chunk_size)
+    # the volume is relative to the loudest sample of the phrase, as in synthesize, which
+    # is found from the phones of the whole phrase before the first word is rendered
+    peak = None
+    if synth.word_memo is not None:
+        words = [word for group in iter_word_groups(phrase) for word in group]
+        word_phones = [None] * len(words)
+        if volume is not None:
+            word_phones = [get_phone_seq(word, spell) for word in words]
+            peak = synth.phrase_peak(normalise_phone_seq(word_phones))
+        rendered = (synth.render_word(word, spell, phones)[1] for word, phones in zip(words, word_phones))
+        return synth.stream_data(rendered, chunk_size, volume, peak)
+    phone_groups = iter_phone_seqs(phrase, spell)
+    if volume is not None:
+        phone_groups = list(phone_groups)
+        peak = synth.phrase_peak(normalise_phone_seq(phone_groups))
+    return synth.stream(phone_groups, chunk_size, volume, peak)
+
 """
 Words to phone sequence class
 object in the class is used to generate word pronunciation sequence
@@ -128,55 +658,32 @@ class Word_to_phone_seq_generator():
     # function that normalize a phrase (including number, punctuation, number, date) into list of words
     # input: phrase (string), output: list of words (list of string)
     def normalize_text(self, phrase):  # phrase to a sequnce of normalized tokens
-        r1 = re.compile(date_number_punctuation_pattern)  # extension version, standard version use word_only_pattern
-        tokens = nltk.tokenize.regexp_tokenize(phrase, r1) # extract tokens (words, dates, numbers, punctuations)
-        lower_case_tokens = [x.lower() for x in tokens]
-
-        normalized_tokens = []
-        r_date = re.compile(date_pattern)
-        r_number = re.compile(number_pattern)
-        r_word = re.compile(word_only_pattern)
-
-        for token in lower_case_tokens:
-            if r_date.match(token):
-                word_date_tokens = nltk.tokenize.regexp_tokenize(DateNormalizer(token).normalized_word_tokens, r_word)
-                for word in word_date_tokens:
-                    normalized_tokens.append(word)
-            elif r_number.match(token):
-                word_number_tokens = nltk.tokenize.regexp_tokenize(Number_Normalizer(token).normalized_word_tokens, r_word)
-                for word in word_number_tokens:
-                    normalized_tokens.append(word)
-            else:
-                normalized_tokens.append(token)
-        return normalized_tokens
+        return normalize_text(phrase)
 
     # function that produce the phone sequence of a given word token sequence
-    # input: list of words (including punctuation) (list of string), output: list of pronunciation (list of string, items in list should be keys in Synth.phones)
+    # input: list of words (including punctuation) (list of string), output: phone sequence (numpy int array, ids of the phone table shared by the lexicon and Synth)
+    @instrument.timed("lookup")
     def word_tokens_to_phone_seq(self, tokens): # word tokens to phone sequence
-        arpabet = nltk.corpus.cmudict.dict()
+        arpabet = lexicon.get_lexicon()  # compiled cmudict, shared by every lookup in the process
         phone_sequence = [] # sequence of phones returned
         for token in tokens:
             try:
-                phone_sequence.append(arpabet[token][0]) # get the pronunciation sequence of the word token
+                phone_sequence.append(arpabet.pronunciation_ids(token)[0]) # get the pronunciation sequence of the word token
             except KeyError: # not an recognizable word token
                 if token in ",.?!":  # if the token is punctuation
                     if token == ",":
-                        phone_sequence.append(["sp"]) # append short salience
+                        phone_sequence.append(arpabet.encode(["sp"])) # append short salience
                     else:
-                        phone_sequence.append(["lp"]) # append long salience
-                else:
-                    print "the word %s can not be find in the cmudict, exit the program" % token
-                    sys.exit()
+                        phone_sequence.append(arpabet.encode(["lp"])) # append long salience
+                else:  # out of vocabulary, pronounce it with the letter-to-sound rules
+                    phone_sequence.append(arpabet.encode(lts.pronounce(token)))
         return self.normalise_phone_seq(phone_sequence)
 
-    # function that convert pronunciation sequence in cmudict format (list of list of phones, separate by word)
-    # into sequence of keys in Synth.phones
-    # by flatten the list and stripping out the stress
-    # input: list of word phone sequence (list of list of string), output: list of phone sequence (list of string)
+    # function that flattens the phone ids of each word into a single phone sequence
+    # (the lexicon stores its pronunciations without stress, as ids of the phone table Synth shares)
+    # input: list of word phone ids (list of numpy int arrays), output: phone ids (numpy int array)
     def normalise_phone_seq(self, phone_sequence):
-        flat_phone_sequence = [phone.lower() for sublist in phone_sequence for phone in sublist]  # reference: http://stackoverflow.com/questions/952914/making-a-flat-list-out-of-list-of-lists-in-python
-        strip_stress_sequence = ["".join([letter for letter in phone if not letter.isdigit()]) for phone in flat_phone_sequence]  # reference: http://stackoverflow.com/questions/12851791/removing-numbers-from-string
-        return strip_stress_sequence
+        return normalise_phone_seq(phone_sequence)
 
 """
 Letter to phone sequence class
@@ -197,192 +704,254 @@ class Letter_to_phone_sequence_generator():
         return [letter for word in word_tokens for letter in word]
 
     # function that produce the phone sequence of a given letter token sequence
-    # input: list of letter (including punctuation) (list of string), output: list of pronunciation (list of string, items in list should be keys in Synth.phones)
+    # input: list of letter (including punctuation) (list of string), output: phone sequence (numpy int array, ids of the phone table shared by the lexicon and Synth)
+    @instrument.timed("lookup")
     def letter_tokens_to_phone_seq(self, letter_tokens):
-        arpabet = nltk.corpus.cmudict.dict()
+        arpabet = lexicon.get_lexicon()  # compiled cmudict, shared by every lookup in the process
         phone_sequence = []
         for letter in letter_tokens:
             try:
                 if letter == "a": # "a" should be pronounced as "ey" instead of "ah"
-                    phone_sequence.append(arpabet[letter][1])
+                    phone_sequence.append(arpabet.pronunciation_ids(letter)[1])
                 else:
-                    phone_sequence.append(arpabet[letter][0])
+                    phone_sequence.append(arpabet.pronunciation_ids(letter)[0])
             except KeyError:
                 if letter in ",.?!": # if the token is punctuation
                     if letter == ",":
-                        phone_sequence.append(["sp"]) # append a short pause
+                        phone_sequence.append(arpabet.encode(["sp"])) # append a short pause
                     else:
-                        phone_sequence.append(["lp"]) # append a long pause
-                else:
-                    print "the letter %s can not be find in the cmudict, exit the program" % letter
-                    sys.exit()
+                        phone_sequence.append(arpabet.encode(["lp"])) # append a long pause
+                else:  # not a letter of the lexicon (e.g. an accented letter)
+                    phone_sequence.append(arpabet.encode(lts.pronounce(letter)))
         return self.normalise_phone_seq(phone_sequence)
 
-    # function that convert pronunciation sequence in cmudict format (list of list of phones, separate by letter)
-    # into sequence of keys in Synth.phones
-    # by flatten the list and stripping out the stress
-    # input: list of letter phone sequence (list of list of string), output: list of phone sequence (list of string)
+    # function that flattens the phone ids of each letter into a single phone sequence
+    # (the lexicon stores its pronunciations without stress, as ids of the phone table Synth shares)
+    # input: list of letter phone ids (list of numpy int arrays), output: phone ids (numpy int array)
     def normalise_phone_seq(self, phone_sequence):
-        flat_phone_sequence = [phone.lower() for sublist in phone_sequence for phone in sublist]  # reference: http://stackoverflow.com/questions/952914/making-a-flat-list-out-of-list-of-lists-in-python
-        strip_stress_sequence = ["".join([letter for letter in phone if not letter.isdigit()]) for phone in flat_phone_sequence]  # reference: http://stackoverflow.com/questions/12851791/removing-numbers-from-string
-        return strip_stress_sequence
+        return normalise_phone_seq(phone_sequence)
+
+
+"""
+Number and date normalization
+numbers (integer or decimal) and dates in format (D)D/(M)M(/(YY)YY) (string) are converted into
+their word form (tuple of words) through tables built once at import:
+every integer below 1000 has its words precomputed, larger integers are read in groups of three digits
+(one thousand two hundred and five), and the expansion of each distinct token is memoized
+"""
+ONES = ['zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten',
+        'eleven', 'twelve', 'thirteen', 'fourteen', 'fifteen', 'sixteen', 'seventeen', 'eighteen', 'nineteen']
+TENS = ['', '', 'twenty', 'thirty', 'forty', 'fifty', 'sixty', 'seventy', 'eighty', 'ninety']
+# names of the groups of three digits, numbers of more groups are read digit by digit
+SCALES = ['', 'thousand', 'million', 'billion', 'trillion']
+ORDINALS = ['', 'first', 'second', 'third', 'fourth', 'fifth', 'sixth', 'seventh', 'eighth', 'ninth', 'tenth',
+            'eleventh', 'twelfth', 'thirteenth', 'fourteenth', 'fifteenth', 'sixteenth', 'seventeenth',
+            'eighteenth', 'nineteenth', 'twentieth']
+MONTHS = ['', 'january', 'february', 'march', 'april', 'may', 'june',
+          'july', 'august', 'september', 'october', 'november', 'december']
+# number of days in each month of a leap year, so 29/02 is accepted when no year is given
+MONTH_DAYS = [0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+# number of distinct number and date tokens whose expansion is kept
+EXPANSION_MEMO_SIZE = 65536
+
+
+# function that builds the words of an integer below 1000
+# input: integer (0-999) (int), output: words (tuple of string)
+def small_int_words(number):
+    if number < 20:
+        return (ONES[number],)
+    if number < 100:
+        if number % 10 == 0:
+            return (TENS[number // 10],)
+        return (TENS[number // 10], ONES[number % 10])
+    if number % 100 == 0:
+        return (ONES[number // 100], 'hundred')
+    return (ONES[number // 100], 'hundred', 'and') + small_int_words(number % 100)
+
+
+# words of every integer below 1000 (index: integer, value: tuple of words)
+NUMBER_WORDS = [small_int_words(number) for number in range(1000)]
+# words of every day of the month (index: day, value: tuple of words)
+DAY_WORDS = [(ORDINALS[day],) for day in range(21)] + [('twenty', ORDINALS[day]) for day in range(1, 10)] + \
+            [('thirtieth',), ('thirty', 'first')]
+
+
+# function that converts an integer into words
+# input: integer (int), output: words (tuple of string)
+def int_to_words(number):
+    if number < 1000:
+        return NUMBER_WORDS[number]
+    if number >= 1000 ** len(SCALES):  # too large to be read as a quantity
+        return tuple(ONES[int(digit)] for digit in str(number))
+    groups = []  # groups of three digits, least significant first
+    while number:
+        number, group = divmod(number, 1000)
+        groups.append(group)
+    words = ()
+    for scale in range(len(groups) - 1, -1, -1):
+        group = groups[scale]
+        if group == 0:
+            continue
+        if scale == 0 and group < 100:  # one thousand and five
+            words += ('and',)
+        words += NUMBER_WORDS[group] + ((SCALES[scale],) if scale else ())
+    return words
+
+
+# function that converts a number token into words, the digits after the point are read one by one
+# input: number (string), output: words (tuple of string)
+def number_to_words(number_str):
+    if "." in number_str:
+        integer, decimal = number_str.split(".")
+        return int_to_words(int(integer)) + ('point',) + tuple(ONES[int(digit)] for digit in decimal)
+    return int_to_words(int(number_str))
+
+
+# function that converts a four digit year into words, e.g. nineteen ninety nine, nineteen hundred and five,
+# two thousand and five, two thousand; other years are read as numbers
+# input: year (int), output: words (tuple of string)
+def year_to_words(year):
+    if not 1000 <= year <= 9999:
+        return int_to_words(year)
+    century, rest = divmod(year, 100)
+    if rest >= 10:  # xxyy, where y is not 0
+        return NUMBER_WORDS[century] + NUMBER_WORDS[rest]
+    if century % 10 == 0:  # x00y or x000
+        words = NUMBER_WORDS[century // 10] + ('thousand',)
+    else:  # xx0y or xx00
+        words = NUMBER_WORDS[century] + ('hundred',)
+    return words + (('and',) + NUMBER_WORDS[rest] if rest else ())
+
+
+# function that converts a date token into words, e.g. 1/2/2016 -> the first of february twenty sixteen
+# two digit years are 1969-2068, as with datetime.strptime
+# input: date in format (D)D/(M)M(/(YY)YY) (string), output: words (tuple of string)
+# raises ValueError for dates that do not exist
+def date_to_words(date_str):
+    fields = date_str.split("/")
+    day, month = int(fields[0]), int(fields[1])
+    if not 1 <= month <= 12:
+        raise ValueError("month is not in correct range")
+    year = None
+    if len(fields) == 3:
+        year = int(fields[2])
+        if len(fields[2]) == 2:
+            year += 1900 if year >= 69 else 2000
+    leap = year is None or (year % 4 == 0 and (year % 100 != 0 or year % 400 == 0))
+    if not 1 <= day <= MONTH_DAYS[month] - (month == 2 and not leap):
+        raise ValueError("day is out of range for month")
+    words = ('the',) + DAY_WORDS[day] + ('of', MONTHS[month])
+    if year is not None:
+        words += year_to_words(year)
+    return words
+
+
+_expansions = {}  # memoized expansions (key: (kind, token), value: tuple of words)
+
+
+# function that expands a number or date token into words, memoized
+# input: kind of token ("date" or "number") (string), token (string), output: words (tuple of string)
+def expand_token(kind, token):
+    key = (kind, token)
+    words = _expansions.get(key)
+    if words is None:
+        words = date_to_words(token) if kind == "date" else number_to_words(token)
+        if len(_expansions) >= EXPANSION_MEMO_SIZE:
+            _expansions.clear()
+        _expansions[key] = words
+    return words
 
 
 """
 Number normalization class
 object in the class is used to convert numerical number (integar or decimal) (string)
-into its corresponding word form (string)
-working process: break numbers into integer part and decimal part
-and convert each part from numbers to words
+into its corresponding word form (string), see number_to_words
 """
 class Number_Normalizer:
     def __init__(self, number_token_str):
         self.number_in_str = number_token_str # input string in numerical format
-        self.normalized_word_tokens = self.number_normalization_handler(self.number_in_str) # corresponding number in word format
-
-    # function that convert the integer part of the numeric number into words format
-    # input: numeric number (integer part) (int), output: integer-part number in word format (string)
-    def int_to_words(self, number):
-        num_to_words = {1: 'one', 2: 'two', 3: 'three', 4: 'four', 5: 'five', \
-                        6: 'six', 7: 'seven', 8: 'eight', 9: 'nine', 10: 'ten', \
-                        11: 'eleven', 12: 'twelve', 13: 'thirteen', 14: 'fourteen', \
-                        15: 'fifteen', 16: 'sixteen', 17: 'seventeen', 18: 'eighteen', \
-                        19: 'nineteen', 20: 'twenty', 30: 'thirty', 40: 'forty', \
-                        50: 'fifty', 60: 'sixty', 70: 'seventy', 80: 'eighty', \
-                        90: 'ninety', 0: 'zero'}
-        try:  # digit in num_to_words dictionary
-            return num_to_words[number]
-        except KeyError:
-            try:  # 2nd digit that not in num_to_words dictionary
-                return num_to_words[number - number % 10] + " " + self.int_to_words(number % 10)
-            except KeyError:
-                try:  # 3rd digit
-                    if number % 100 == 0:
-                        return num_to_words[(number - number % 100) / 100] + " hundred"
-                    else:
-                        return num_to_words[(number - number % 100) / 100] + " hundred and " + self.int_to_words(number % 100)
-                except:
-                    raise ValueError("number is too large") # number > 999
-
-    # function that converts the decimal part of the numeric number into words format
-    # input: numeric decimal number (numbers after "point") (string), output: decimal-part number in word format (string)
-    def decimal_to_words(self, decimal):  # input should be an str
-        decimal_dict = {"1": 'one', "2": 'two', "3": 'three', "4": 'four', "5": 'five', \
-                        "6": 'six', "7": 'seven', "8": 'eight', "9": 'nine', "0": "zero"}
-        if len(decimal) == 1:
-            return decimal_dict[decimal]
-        else:
-            return self.decimal_to_words(decimal[0]) + " " + self.decimal_to_words(decimal[1:]) # remove the first digit
-
-    # function that separate the numeric number into integer part and decimal part, as they have different word format
-    # input: numeric number (string), output: corresponding number in words format (string)
-    def number_normalization_handler(self, number_str):
-        if "." in number_str:
-            return self.int_to_words(int(number_str.split(".")[0])) + " point " + self.decimal_to_words(number_str.split(".")[1])
-        else:
-            return self.int_to_words(int(number_str))
+        self.normalized_word_tokens = " ".join(expand_token("number", number_token_str)) # corresponding number in word format
 
 
 """
 Date normalization class
 object in the class is used to convert dates in format: (D)D/(M)M(/(YY)YY) (string)
-into its corresponding word form (string)
-working process: convert the date string into and standard date object (handle out of range problems),
-then convert dates, month, years to words separately (they have different to-word rules)
-and concatenate them into a single string
+into its corresponding word form (string), see date_to_words
 """
 class DateNormalizer():
     def __init__(self, date_token_str):
         self.date_in_str = date_token_str   # input string in (D)D/(M)M(/(YY)YY) format
-        self.normalized_word_tokens = self.date_normalization_handler(self.date_in_str) # corresponding date in word format
-
-    # function that convert a input string in date format into an datetime object
-    # purpose: some numbers in format (D)D/(M)M(/(YY)YY) may be invalid, e.g. 32/11/2016 is invalid
-    # it will captured when creating datetime object
-    # input: date string in format (D)D/(M)M(/(YY)YY) (string), output: datetime object of the given date (datetime object)
-    def date_str_to_object(self, date_str):  # normalize date string into one format, raise relevent error if the format is invalid
-        if len(date_str.split("/")) == 2:  # only date and month
-            return datetime.strptime(date_str, "%d/%m")
-        else:  # date, month and year
-            if len(date_str.split("/")[2]) == 2:  # year without specifying the century
-                return datetime.strptime(date_str, "%d/%m/%y")
-            else:  # year with the century specified
-                return datetime.strptime(date_str, "%d/%m/%Y")
-
-    # function that convert a numerical date into its corresponding date string in word format
-    # input: numerical date(1-31) (int), output: date in words format (string)
-    def date_to_words(self, date_number):  # date, not month or year
-        date = {1: 'first', 2: 'second', 3: 'third', 4: 'fourth', 5: 'fifth', \
-                6: 'sixth', 7: 'seventh', 8: 'eighth', 9: 'ninth', 10: 'tenth', \
-                11: 'eleventh', 12: 'twelfth', 13: 'thirteenth', 14: 'fourteenth', \
-                15: 'fifteenth', 16: 'sixteenth', 17: 'seventeenth', 18: 'eighteenth', \
-                19: 'nineteenth', 20: ['twentieth', 'twinty'], 30: ['thirtieth', 'thirty']}
-        try:  # 1-20
-            return date[date_number]
-        except KeyError:  # 21-31
-            return date[date_number - date_number % 10][1] + " " + self.date_to_words(date_number % 10)
-
-    # function that convert a numerical month into its corresponding month string in word format
-    # input: numerical month(1-12) (int), output: month in words format (string)
-    def month_to_words(self, month_number):
-        month = {1: 'january', 2: 'february', 3: 'march', 4: 'april', 5: 'may', 6: 'june', \
-                 7: 'july', 8: 'august', 9: 'september', 10: 'october', 11: 'november', 12: 'december'}
-        try:
-            return month[month_number]
-        except:
-            raise ValueError("month is not in correct range")
-
-    # function that convert a numerical year string into its corresponding year string in word format
-    # input: numerical year(only consider year 1000 - 9999) (int), output: date in words format (string)
-    def year_to_words(self, year_number):  # four digit year in int, only consider year 1000 - 9999
-        year_str = str(year_number)
-        if not year_str[2] == "0": # xxxx, where x is a digit not equal to 0
-            return Number_Normalizer(year_str[0] + year_str[1]).normalized_word_tokens + " " + Number_Normalizer(year_str[2] + year_str[3]).normalized_word_tokens
-        else:  # xx0x or x00x or xx00 or x000
-            if not year_str[3] == "0": # xx0x or x00x
-                if not year_str[1] == "0": # xx0x
-                    return Number_Normalizer(year_str[0] + year_str[1]).normalized_word_tokens + " hundred and " + Number_Normalizer(year_str[3]).normalized_word_tokens
-                else: # x00x
-                    return Number_Normalizer(year_str[0]).normalized_word_tokens + " thousand and " + Number_Normalizer(year_str[3]).normalized_word_tokens
-            else:  # xx00 or x000
-                if not year_str[1] == "0": # xx00
-                    return Number_Normalizer(year_str[0] + year_str[1]).normalized_word_tokens + " hundred"
-                else:  # x000:
-                    return Number_Normalizer(year_str[0]).normalized_word_tokens + " thousand"
-
-    # function that separate date(numeric), month(numeric), year(numeric), of string in format (D)D/(M)M(/(YY)YY)
-    # and produce corresponding date, month, year in words by calling date_to_words, month_to_words, and year_to_words
-    # input: numerical date in format (D)D/(M)M(/(YY)YY) (string), output: date string in words (string)
-    def date_normalization_handler(self, date_str):
-        date_object = self.date_str_to_object(date_str)
-        date_in_words = self.date_to_words(date_object.day)
-        month_in_words = self.month_to_words(date_object.month)
-        if len(date_str.split("/")) == 2:  # only date and month
-            return "the {} of {}".format(date_in_words, month_in_words)
-        else:  # date, month, year
-            year_in_words = self.year_to_words(date_object.year)
-            return "the {} of {} {}".format(date_in_words, month_in_words, year_in_words)
+        self.normalized_word_tokens = " ".join(expand_token("date", date_token_str)) # corresponding date in word format
 
 
 
-if __name__ == "__main__":
-    syn_rate = 16000
-    S = Synth(wav_folder=args.monophones, rate=syn_rate)
+def testSymbolOnlyToken():
+    import warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", lts.UnknownWordWarning)
+        assert lts.pronounce("_") == lts.NO_PHONES
+        for memo_bytes in (0, WORD_MEMO_BYTES):
+            synth = Synth(os.path.join(os.path.dirname(os.path.abspath(__file__)), "monophones"), 16000,
+                          memo_bytes=memo_bytes)
+            for spell in (False, True):
+                for phrase in ("_", "a _ b", "hello _"):
+                    out = synthesize(synth, phrase, spell=spell)
+                    assert len(out.data) > 0
+                    streamed = np.concatenate(list(stream_synthesis(synth, phrase, spell=spell)))
+                    assert np.array_equal(streamed, out.data)
 
-    out = SA.Audio(rate=syn_rate)
-    # print out.data, type(out.data) # for testing
 
-    phone_seq = get_phone_seq(args.phrase[0])
-    out.data = S.concatenate(phone_seq)
+if __name__ == "__main__":
+    args = parser.parse_args()
+    # messages go to stderr when stdout carries the audio
+    log = sys.stderr if args.stdout is not None else sys.stdout
+    # print(args) # for testing purpose
+    print(args.monophones, file=log)
+
+    if args.profile is not None:
+        instrument.enable()
+        instrument.record("imports", import_seconds)
+    lts.set_user_lexicon(args.user_lexicon)
+    syn_rate = args.rate
+    S = Synth(wav_folder=args.monophones, rate=syn_rate)
 
-    # data modification
-    if args.volume is not None: # ValueError will be handled by SA
-        out.rescale(args.volume)
-        print "synthesised audio is rescaled by a factor of %.4f" %args.volume
+    # stream the audio to stdout chunk by chunk, so memory use doesn't grow with the phrase
+    if args.stdout is not None:
+        stdout = getattr(sys.stdout, "buffer", sys.stdout)
+        writer_class = SA.WavWriter if args.stdout == "wav" else SA.PcmWriter
+        with instrument.Stage("stream"), writer_class(stdout, 1, syn_rate, 2) as writer:
+            for chunk in stream_synthesis(S, args.phrase[0], spell=args.spell, volume=args.volume,
+                                          speaking_rate=args.speaking_rate):
+                writer.append(chunk)
+        if not args.play and args.outfile is None:
+            if args.profile is not None:
+                instrument.write_report(args.profile)
+            sys.exit()
+
+    # synthesis and data modification
+    utterance_cache = None
+    if args.cache_dir is not None:
+        utterance_cache = cache.UtteranceCache(args.cache_dir, int(args.cache_size * 2**20))
+    with instrument.Stage("synthesize"):
+        out = synthesize(S, args.phrase[0], spell=args.spell, volume=args.volume, cache=utterance_cache,
+                         speaking_rate=args.speaking_rate)
+    if args.volume is not None:
+        print("synthesised audio is rescaled by a factor of %.4f" %args.volume, file=log)
 
     # output of the modified audio
+    # playback runs in the background, so the file is written while the audio plays
     if args.play:
-        out.play()
+        print("Playing...", file=log)
+        play_start = instrument.timer()
+        playback = out.play_async()
     if args.outfile is not None:
-        out.save(args.outfile)
-        print "synthesised audio is saved at: %s" %args.outfile
\ No newline at end of file
+        with instrument.Stage("save"):
+            out.save(args.outfile)
+        print("synthesised audio is saved at: %s" %args.outfile, file=log)
+    if args.play:
+        playback.wait()
+        if instrument.is_enabled():
+            instrument.record("play", instrument.timer() - play_start)
+        print("Stopped playing", file=log)
+    if args.profile is not None:
+        instrument.write_report(args.profile)
\ No newline at end of file